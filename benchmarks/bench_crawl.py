@@ -0,0 +1,182 @@
+''' End-to-end crawl of a synthetic site served by a local fake cache server,
+reporting pages/s, CPU time per page and peak RSS. The crawl runs in a
+temporary directory with the settings of config.ini, except for the ones
+given here, and never registers with the real cache server.
+
+Run from the repository root:
+    python -m benchmarks.bench_crawl --pages 5000 --mode sync --threads 4
+    python -m benchmarks.bench_crawl --mode pipeline --parse_processes 4 --latency 0.05
+    python -m benchmarks.bench_crawl --nodes 4
+    python -m benchmarks.bench_crawl --replay --latency 0.05
+'''
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from multiprocessing import get_context
+
+from benchmarks.fake_cache_server import (
+    FakeCacheServer, add_graph_arguments, graph_from_arguments)
+
+# The crawl runs in a temporary directory, so the repository has to be on
+# the path explicitly.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(args, conn):
+    server = FakeCacheServer(graph_from_arguments(args), latency=args.latency)
+    conn.send(server.address)
+    server.serve_forever()
+
+
+def crawl_node(config, node):
+    # One node of a partitioned crawl, in a process of its own.
+    sys.path.insert(0, ROOT)
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 2)
+    from crawler import Crawler
+    from crawler.cluster import PartitionedFrontier, enter_node
+    enter_node(config, node)
+    Crawler(config, restart=True, frontier_factory=PartitionedFrontier).start()
+
+
+def fill_cache(config):
+    # The crawl that fills the response cache for --replay, in a process of
+    # its own so its metrics are not counted.
+    sys.path.insert(0, ROOT)
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 2)
+    from crawler import Crawler
+    Crawler(config, restart=True).start()
+
+
+def crawl_nodes(config, nodes):
+    # Returns the merged metrics snapshot of the nodes.
+    import json
+    from crawler.cluster import merge
+    config.nodes = nodes
+    context = get_context("spawn")
+    processes = [
+        context.Process(target=crawl_node, args=(config, node))
+        for node in range(nodes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    merge(config)
+    with open(os.path.join(config.cluster_dir, "metrics.json")) as f:
+        return json.load(f)
+
+
+def main(args):
+    # The server runs in its own process so its CPU time is not counted.
+    context = get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    server = context.Process(target=serve, args=(args, sender), daemon=True)
+    server.start()
+    address = receiver.recv()
+
+    config_file = os.path.abspath(args.config_file)
+    workdir = tempfile.mkdtemp(prefix="bench_crawl_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    # Loggers, also those of parser processes, only write to their files
+    # under workdir.
+    sys.stderr.flush()
+    stderr = os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 2)
+    os.close(devnull)
+    sys.path.insert(0, ROOT)
+    try:
+        from utils.config import Config
+        from utils.metrics import metrics
+        from crawler import Crawler
+
+        cparser = ConfigParser()
+        cparser.read(config_file)
+        graph = graph_from_arguments(args)
+        cparser["CRAWLER"]["SEEDURL"] = ",".join(graph.seed_urls())
+        cparser["CRAWLER"]["POLITENESS"] = str(args.politeness)
+        local = cparser["LOCAL PROPERTIES"]
+        local["SAVE"] = "frontier.db"
+        local["STORE"] = "sqlite"
+        local["THREADCOUNT"] = str(args.threads)
+        local["DOWNLOADMODE"] = args.mode
+        local["PARSEPROCESSES"] = str(args.parse_processes)
+        local["METRICSFILE"] = "Logs/metrics.json"
+        if args.replay:
+            # Absolute, so the nodes of a partitioned replay share it.
+            local["RESPONSECACHE"] = os.path.join(workdir, "responses")
+        config = Config(cparser)
+        config.cache_server = address
+        if args.replay:
+            process = get_context("spawn").Process(target=fill_cache, args=(config,))
+            process.start()
+            process.join()
+            config.replay = True
+
+        start_usage = resource.getrusage(resource.RUSAGE_SELF)
+        # Not zero after the crawl that filled the response cache.
+        start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        if args.nodes > 1:
+            snapshot = crawl_nodes(config, args.nodes)
+        else:
+            Crawler(config, restart=True).start()
+            snapshot = metrics.snapshot()
+        elapsed = time.perf_counter() - start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    finally:
+        sys.stderr.flush()
+        os.dup2(stderr, 2)
+        os.close(stderr)
+        os.chdir(cwd)
+        server.terminate()
+
+    # Pages served from the response cache are not downloads.
+    pages = snapshot["pages"] + snapshot["counters"].get("response_cache_hits", 0)
+    cpu = (
+        usage.ru_utime + usage.ru_stime
+        - start_usage.ru_utime - start_usage.ru_stime
+        + children.ru_utime + children.ru_stime
+        - start_children.ru_utime - start_children.ru_stime)
+    print(f"mode {args.mode}, {args.threads} threads, "
+          f"{args.parse_processes} parser processes, {args.nodes} nodes"
+          + (", replayed from the response cache" if args.replay else ""))
+    print(f"{pages} pages in {elapsed:.2f}s: {pages / elapsed:.1f} pages/s, "
+          f"{1000 * cpu / max(pages, 1):.2f} ms CPU/page")
+    print(f"peak RSS {usage.ru_maxrss / 1024:.1f} MiB, "
+          f"child processes {children.ru_maxrss / 1024:.1f} MiB")
+    counters = snapshot["counters"]
+    print(f"{counters.get('exact_duplicates', 0)} exact and "
+          f"{counters.get('near_duplicates', 0)} near duplicates, "
+          f"{counters.get('exact_duplicate_seconds_saved', 0):.2f}s saved "
+          f"on exact ones")
+    for name, latency in sorted(snapshot["latency"].items()):
+        print(f"{name:>20}: {latency['count']:8d} x {1000 * latency['mean']:8.3f} ms")
+    if args.keep:
+        print(f"crawl output kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--mode", type=str, default="sync",
+        choices=["sync", "async", "pipeline"])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--parse_processes", type=int, default=0)
+    parser.add_argument("--nodes", type=int, default=1,
+        help="run a partitioned crawl with this many node processes")
+    parser.add_argument("--replay", action="store_true", default=False,
+        help="crawl once to fill the response cache and time a replay of it")
+    parser.add_argument("--politeness", type=float, default=0.0)
+    parser.add_argument("--keep", action="store_true", default=False,
+        help="keep the frontier, logs and page store of the crawl")
+    add_graph_arguments(parser)
+    main(parser.parse_args())
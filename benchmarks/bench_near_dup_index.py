@@ -0,0 +1,81 @@
+''' Compares near_dup_index.FingerprintIndex with simhash.SimhashIndex.
+
+Run from the repository root:
+    python -m benchmarks.bench_near_dup_index --sizes 100000 1000000
+'''
+import time
+import random
+import tracemalloc
+from argparse import ArgumentParser
+
+from simhash import Simhash, SimhashIndex
+from near_dup_index import FingerprintIndex
+
+
+def make_fingerprints(size, seed=0):
+    # Clusters of fingerprints a few bits apart, like pages of one site.
+    rng = random.Random(seed)
+    bases = [rng.getrandbits(64) for _ in range(max(1, size // 20))]
+    fingerprints = list()
+    for _ in range(size):
+        value = rng.choice(bases)
+        for _ in range(rng.randint(0, 8)):
+            value ^= 1 << rng.randrange(64)
+        fingerprints.append(value)
+    return fingerprints
+
+
+def measure(name, build, query, queries):
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = build()
+    build_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    matches = [query(index, value) for value in queries]
+    query_time = time.perf_counter() - start
+    print(
+        f"{name:>18}: build {build_time:8.2f}s, "
+        f"{len(queries) / query_time:10.0f} queries/s, "
+        f"{memory / 2 ** 20:8.1f} MiB")
+    return matches
+
+
+def main(sizes, n_queries, skip_reference):
+    for size in sizes:
+        print(f"{size} documents")
+        urls = [f"https://www.ics.uci.edu/page/{i}" for i in range(size)]
+        fingerprints = make_fingerprints(size)
+        queries = random.Random(1).sample(fingerprints, min(n_queries, size))
+
+        def build_new():
+            index = FingerprintIndex(k=5)
+            index.add_many(urls, fingerprints)
+            return index
+        new = measure(
+            "FingerprintIndex", build_new,
+            lambda index, value: index.get_matches(value), queries)
+
+        if skip_reference:
+            continue
+        def build_reference():
+            index = SimhashIndex([], k=5)
+            for url, value in zip(urls, fingerprints):
+                index.add(url, Simhash(value))
+            return index
+        reference = measure(
+            "SimhashIndex", build_reference,
+            lambda index, value: index.get_near_dups(Simhash(value)), queries)
+        assert all(
+            sorted(a) == sorted(b) for a, b in zip(new, reference)), \
+            "FingerprintIndex results differ from SimhashIndex"
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--skip_reference", action="store_true", default=False)
+    args = parser.parse_args()
+    main(args.sizes, args.queries, args.skip_reference)
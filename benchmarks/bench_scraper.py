@@ -0,0 +1,93 @@
+''' Micro-benchmarks of scraper.scraper, scraper.is_valid and
+persistent_index.PersistentSimhashIndex on pages of the synthetic site of
+benchmarks.fake_cache_server, without a server or a crawl.
+
+Run from the repository root:
+    python -m benchmarks.bench_scraper --pages 2000 --page_size 20000
+'''
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from argparse import ArgumentParser
+
+from benchmarks.fake_cache_server import add_graph_arguments, graph_from_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def responses(graph, n_pages):
+    from utils.download import make_response
+    urls = [graph.page_url(number) for number in range(n_pages)]
+    return [
+        make_response(url, True, 200, graph.response(url),
+            {"Content-Type": "text/html; charset=utf-8"})
+        for url in urls]
+
+
+def rate(name, count, unit, function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>36}: {count / elapsed:12.0f} {unit}/s")
+    return result
+
+
+def main(args):
+    graph = graph_from_arguments(args)
+    workdir = tempfile.mkdtemp(prefix="bench_scraper_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    try:
+        import scraper
+        from persistent_index import PersistentSimhashIndex
+
+        resps = responses(graph, args.pages)
+        pairs = [(resp.url, resp) for resp in resps]
+        parsed = rate("scraper.parse_page", len(pairs), "pages",
+            lambda: [scraper.parse_page(url, resp) for url, resp in pairs])
+        rate("scraper.scraper", len(pairs), "pages",
+            lambda: [scraper.scraper(url, resp) for url, resp in pairs])
+        scraper.get_page_store().close()
+        scraper.get_index().close()
+
+        links = [
+            link for page in parsed for link in page.links] + [
+            "https://www.ics.uci.edu/events/day/2024-01-01",
+            "https://www.ics.uci.edu/about/people/about/people",
+            "https://www.ics.uci.edu/files/paper.pdf",
+            "https://www.google.com/search?q=uci"] * 100
+        rate("scraper.is_valid", len(links), "urls",
+            lambda: [scraper.is_valid(link) for link in links])
+
+        rng = random.Random(args.seed)
+        fingerprints = [rng.getrandbits(64) for _ in range(args.fingerprints)]
+        urls = [f"https://www.ics.uci.edu/page/{i}" for i in range(len(fingerprints))]
+        # No background flushes, so flush writes every document.
+        index = PersistentSimhashIndex(
+            os.path.join(workdir, "bench_index"), flush_interval=3600)
+        def add():
+            for url, value in zip(urls, fingerprints):
+                index.add_fingerprint(url, value)
+        rate("PersistentSimhashIndex add", len(urls), "docs", add)
+        queries = rng.sample(fingerprints, min(len(fingerprints), 10000))
+        rate("PersistentSimhashIndex query", len(queries), "queries",
+            lambda: [index.get_fingerprint_matches(value) for value in queries])
+        rate("PersistentSimhashIndex flush", len(urls), "docs", index.flush)
+        index.close()
+        rate("PersistentSimhashIndex load", len(urls), "docs",
+            lambda: PersistentSimhashIndex(os.path.join(workdir, "bench_index")).close())
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--fingerprints", type=int, default=200000)
+    add_graph_arguments(parser)
+    parser.set_defaults(pages=2000)
+    main(parser.parse_args())
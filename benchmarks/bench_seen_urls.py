@@ -0,0 +1,87 @@
+''' Measures crawler.seen_urls.SeenUrls: memory per million urls, and how
+fast new and repeated links are checked compared with a lookup in the
+SQLite frontier store. Fails if the memory goes past the documented bound.
+
+Run from the repository root:
+    python -m benchmarks.bench_seen_urls --sizes 100000 1000000
+'''
+import os
+import time
+import shutil
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+
+from utils import get_urldigest
+from crawler.seen_urls import SeenUrls, url_key
+from crawler.store import SQLiteStore
+
+# Bytes per million urls that the SeenUrls docstring promises, including
+# the set of keys not merged yet.
+BYTES_PER_MILLION = 16 * 2 ** 20
+BATCH = 50
+
+
+def make_urls(size):
+    return [f"https://www.ics.uci.edu/page/{i}?q={i % 97}" for i in range(size)]
+
+
+def rate(name, count, function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>28}: {count / elapsed:12.0f} urls/s")
+    return result
+
+
+def add_all(seen, keys):
+    ''' Adds keys in batches like the links of a page and returns how many
+    were new. '''
+    fresh = 0
+    for i in range(0, len(keys), BATCH):
+        fresh += sum(seen.add_new(keys[i:i + BATCH]))
+    return fresh
+
+
+def main(sizes, store_lookups):
+    for size in sizes:
+        print(f"{size} urls")
+        urls = make_urls(size)
+        keys = [url_key(get_urldigest(url)) for url in urls]
+
+        tracemalloc.start()
+        seen = SeenUrls()
+        fresh = rate("SeenUrls new", size, lambda: add_all(seen, keys))
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert fresh == size, "a new url was taken as seen"
+        repeated = rate("SeenUrls repeated", size, lambda: add_all(seen, keys))
+        assert not repeated, "a repeated url was taken as new"
+
+        per_million = memory * 1000000 / size
+        print(f"{'memory':>28}: {memory / 2 ** 20:12.1f} MiB, "
+              f"{per_million / 2 ** 20:.1f} MiB per million urls "
+              f"(nbytes {seen.nbytes / 2 ** 20:.1f} MiB)")
+        if size >= 1000000:
+            assert per_million <= BYTES_PER_MILLION, \
+                f"{per_million / 2 ** 20:.1f} MiB per million urls"
+
+        workdir = tempfile.mkdtemp(prefix="bench_seen_urls_")
+        try:
+            store = SQLiteStore(os.path.join(workdir, "frontier.db"), 1)
+            store.add_urls([(get_urldigest(url).hex(), url, 0, 0.0) for url in urls])
+            store.commit()
+            sample = [get_urldigest(url).hex() for url in urls[:store_lookups]]
+            rate("SQLiteStore repeated", len(sample),
+                lambda: [urlhash in store for urlhash in sample])
+            store.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--store_lookups", type=int, default=100000)
+    args = parser.parse_args()
+    main(args.sizes, args.store_lookups)
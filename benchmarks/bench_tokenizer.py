@@ -0,0 +1,108 @@
+''' Tokens per second of tokenizer.py against the implementations it
+replaced in scraper.py and assignment1methods.py.
+
+Run from the repository root:
+    python -m benchmarks.bench_tokenizer
+'''
+import time
+import random
+from argparse import ArgumentParser
+
+import nltk
+from stopwords import stopwords
+import tokenizer
+
+
+def nltk_word_tokenize(text):
+    try:
+        return nltk.word_tokenize(text)
+    except LookupError:
+        # Without the punkt data only the word tokenizer can run, which
+        # gives the same tokens on text without sentence punctuation.
+        return nltk.tokenize.NLTKWordTokenizer().tokenize(text)
+
+
+def old_scraper_tokenize(text):
+    return [token for token in nltk_word_tokenize(text) if token not in stopwords and len(token) > 2]
+
+
+def old_assignment_tokenize(text):
+    tokens = list()
+    for line in text.splitlines():
+        i = 0
+        while i < len(line):
+            j = 1
+            token = line[i : i + j]
+            if not token.isalnum():
+                i += 1
+                continue
+            while line[i : i + j + 1].isalnum() and i + j < len(line):
+                j += 1
+                token = line[i : i + j]
+            token = token.lower()
+            if token not in stopwords:
+                tokens.append(token)
+            i = i + j
+    return tokens
+
+
+def old_word_frequencies(tokens):
+    freqs = dict()
+    for i in range(len(tokens)):
+        if tokens[i] in freqs:
+            continue
+        freqs[tokens[i]] = 1
+        for j in range(i + 1, len(tokens)):
+            if tokens[j] == tokens[i]:
+                freqs[tokens[i]] += 1
+    return freqs
+
+
+def make_texts(n_texts, words_per_text, seed=0):
+    rng = random.Random(seed)
+    vocabulary = stopwords + [
+        "research", "students", "Computer", "science", "faculty", "graduate",
+        "informatics", "UCI", "2024", "cannot", "wanna", "e-mail", "data"]
+    return [
+        " ".join(rng.choice(vocabulary) for _ in range(words_per_text))
+        for _ in range(n_texts)]
+
+
+def rate(name, function, texts, count_tokens):
+    start = time.perf_counter()
+    results = function(texts)
+    elapsed = time.perf_counter() - start
+    n_tokens = sum(count_tokens(result) for result in results)
+    print(f"{name:>36}: {n_tokens / elapsed:12.0f} tokens/s")
+    return results
+
+
+def main(n_texts, words_per_text):
+    texts = make_texts(n_texts, words_per_text)
+    cleaned = [tokenizer.clean_text(text) for text in texts]
+
+    old = rate("scraper tokenize (nltk, list)",
+        lambda texts: [old_scraper_tokenize(text) for text in texts], cleaned, len)
+    new = rate("tokenizer.tokenize",
+        lambda texts: [tokenizer.tokenize(text) for text in texts], cleaned, len)
+    rate("tokenizer.tokenize_many (uncleaned)", tokenizer.tokenize_many, texts, len)
+    assert old == new, "tokenizer.tokenize differs from nltk"
+
+    old = rate("assignment1 tokenize",
+        lambda texts: [old_assignment_tokenize(text) for text in texts], texts, len)
+    new = rate("tokenizer.tokenize_words",
+        lambda texts: [tokenizer.tokenize_words(text) for text in texts], texts, len)
+    assert old == new, "tokenizer.tokenize_words differs from assignment1methods"
+
+    # The quadratic counter only runs on a slice to finish in time.
+    sample = [token for tokens in new[:20] for token in tokens]
+    rate("assignment1 computeWordFrequencies", lambda _: [old_word_frequencies(sample)], None, lambda _: len(sample))
+    rate("tokenizer.word_frequencies", lambda _: [tokenizer.word_frequencies(sample)], None, lambda _: len(sample))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=500)
+    args = parser.parse_args()
+    main(args.texts, args.words)
@@ -0,0 +1,159 @@
+''' Checks that url_filter.is_valid gives the same verdicts as the chain of
+regexes it replaced in scraper.py, and compares their speed.
+
+The corpus is the urls of a frontier save file (--save_file), a file with
+one url per line (--urls), or by default urls built from the subdomains in
+report.txt with the paths, queries and traps seen while crawling them.
+
+Run from the repository root:
+    python -m benchmarks.bench_url_filter
+    python -m benchmarks.bench_url_filter --save_file frontier.db --store sqlite
+'''
+import re
+import time
+import random
+from argparse import ArgumentParser
+from urllib.parse import urlparse
+
+import url_filter
+
+
+def old_is_valid(url):
+    try:
+        url = url.lower()
+        parsed = urlparse(url)
+        if parsed.scheme not in set(["http", "https"]):
+            return False
+        if re.match(
+            r".*\.(src|rpm|css|js|bmp|gif|jpe?g|ico"
+            + r"|png|tiff?|mid|mp2|mp3|mp4"
+            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+            + r"|epub|dll|cnf|tgz|sha1"
+            + r"|thmx|mso|arff|rtf|jar|csv"
+            + r"|rm|smil|wmv|swf|wma|zip|rar|gz|sql|txt|ppsx|img|ff)$", parsed.path):
+            return False
+        if re.match(r".*(ical|tribe_events?|tribe-bar-date|action=|share=(twitter|facebook)|do=).*", parsed.query):
+            return False
+        if '.fr' in parsed.path:
+            return False
+        if 'calendar' in url:
+            return False
+        if re.match(r"/(events|day|month).*/\d{4}-\d{2}(-\d{2})?.*", parsed.path):
+            return False
+        if re.match(r".*/wp-(content|login).*", parsed.path):
+            return False
+        if 'gitlab' in parsed.hostname and ('commit' in parsed.path or 'tag' in parsed.path):
+            return False
+        if re.match(r"^.*?(/[a-zA-Z]+?/).*?\1.*$|^.*?/([a-zA-Z]+?/)\2.*$", url) and 'grape.ics.uci.edu/wiki/public/wiki' not in url:
+            return False
+        if not re.match(
+            r".*(ics|cs|informatics|stat|today)\.uci\.edu",
+            parsed.hostname,
+        ):
+            return False
+        if "today.uci.edu" in parsed.hostname and "department/information_computer_sciences" not in parsed.path:
+            return False
+        return True
+    except Exception:
+        return False
+
+
+PATHS = [
+    "", "/", "/about", "/about/people", "/people/faculty/", "/~eppstein/pubs/",
+    "/research/areas/ai", "/events/day/2023-10-04", "/events/list/?tribe-bar-date=2023-01",
+    "/month/2022-05", "/wp-content/uploads/2021/03/poster.pdf", "/wp-login.php",
+    "/files/slides.PPTX", "/img/logo.png", "/data/set.tar.gz", "/index.php",
+    "/wiki/public/wiki/cs221/wiki", "/doku.php/start?do=edit", "/fr/accueil",
+    "/a/b/a/b", "/news/news/2020", "/seminar/seminar", "/dir/12/dir/12",
+    "/department/information_computer_sciences/story", "/-/commit/ab12",
+    "/page/2/", "/page/2/page/3", "/~user/CLASSES/cs121/", "/calendar/week",
+    "/pubs/paper.PDF", "/a/b/c/d/e/f/g/a", "/x.html", "/tags/ml/tags/ai/",
+]
+QUERIES = [
+    "", "?p=123", "?share=twitter", "?share=facebook&x=1", "?action=login",
+    "?outlook-ical=1", "?replytocom=5", "?page=3&sort=desc", "?id=a/b/a/",
+]
+OTHER_HOSTS = [
+    "www.uci.edu", "today.uci.edu", "www.google.com", "gitlab.ics.uci.edu",
+    "grape.ics.uci.edu", "www.cs.uci.edu.example.com", "archive.ics.uci.edu",
+]
+
+
+def default_corpus(n_urls, seed=0):
+    hosts = list(OTHER_HOSTS)
+    try:
+        with open("report.txt") as f:
+            for line in f:
+                host = line.split(":")[0].strip()
+                if host.endswith(".uci.edu") and " " not in host:
+                    hosts.append(host)
+    except OSError:
+        pass
+    rng = random.Random(seed)
+    corpus = [
+        "mailto:someone@ics.uci.edu", "ftp://ftp.ics.uci.edu/pub", "http:///x",
+        "https://[::1/", "HTTPS://WWW.ICS.UCI.EDU/About/About/",
+        "https://www.ics.uci.edu/a\n/a/b"]
+    while len(corpus) < n_urls:
+        path = rng.choice(PATHS)
+        for _ in range(rng.randint(0, 2)):
+            path += rng.choice(PATHS)
+        corpus.append(
+            f"{rng.choice(['http', 'https'])}://{rng.choice(hosts)}"
+            f"{path}{rng.choice(QUERIES)}")
+    return corpus
+
+
+def load_save_file(path, store):
+    from crawler.store import STORES
+    save = STORES[store](path, 1)
+    try:
+        return [url for url, _ in save.values()]
+    finally:
+        save.close()
+
+
+def rate(name, function, urls):
+    start = time.perf_counter()
+    result = function(urls)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>36}: {len(urls) / elapsed:12.0f} urls/s")
+    return result
+
+
+def main(args):
+    if args.save_file:
+        urls = load_save_file(args.save_file, args.store)
+    elif args.urls:
+        with open(args.urls) as f:
+            urls = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        urls = default_corpus(args.n_urls)
+    print(f"{len(urls)} urls")
+
+    old = rate("old is_valid",
+        lambda urls: [old_is_valid(url) for url in urls], urls)
+    new = rate("url_filter.is_valid",
+        lambda urls: [url_filter.is_valid(url) for url in urls], urls)
+    accepted = rate("url_filter.filter_urls", url_filter.filter_urls, urls)
+
+    differences = [
+        (url, before, after)
+        for url, before, after in zip(urls, old, new) if before != after]
+    for url, before, after in differences[:20]:
+        print(f"{url!r}: old {before}, new {after}")
+    assert not differences, f"{len(differences)} verdicts differ"
+    assert accepted == [url for url, verdict in zip(urls, new) if verdict]
+    print(f"{sum(new)} of {len(urls)} urls accepted by both")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--save_file", type=str, default=None)
+    parser.add_argument("--store", type=str, default="sqlite", choices=["sqlite", "shelve"])
+    parser.add_argument("--urls", type=str, default=None,
+        help="file with one url per line")
+    parser.add_argument("--n_urls", type=int, default=200000)
+    main(parser.parse_args())
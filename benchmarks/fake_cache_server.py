@@ -0,0 +1,235 @@
+''' Local stand-in for the spacetime cache server, serving a synthetic link
+graph over the same protocol: GET /?q=<url>&u=<user agent> returns a CBOR
+map with the url, the status and a pickled requests.Response, which is what
+utils.download and utils.response.Response expect. Nothing is registered,
+set config.cache_server to the address of this server instead of calling
+utils.server_registration.get_cache_server.
+
+Run from the repository root:
+    python -m benchmarks.fake_cache_server --port 8000 --pages 5000
+'''
+import time
+import pickle
+import random
+import hashlib
+from threading import Thread
+from argparse import ArgumentParser
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import cbor
+import requests
+
+HOSTS = (
+    "www.ics.uci.edu", "www.cs.uci.edu", "www.informatics.uci.edu",
+    "www.stat.uci.edu", "vision.ics.uci.edu", "ngs.ics.uci.edu",
+    "mlphysics.ics.uci.edu", "sli.ics.uci.edu")
+
+
+class SiteGraph(object):
+    ''' Deterministic synthetic crawl. pages pages spread over HOSTS, each
+    with links_per_page links and about page_size bytes of text. A
+    duplicate_rate fraction of pages copies the text of another page with a
+    few words changed, and an exact_duplicate_rate fraction is a mirror
+    with the same title and text. A trap_rate fraction links into a crawler trap:
+    calendars and repeated paths that is_valid should reject, and a pager
+    (?page=n) that it does not, which goes trap_depth pages deep. A
+    missing_rate fraction of urls answers 404. Every host serves a
+    robots.txt disallowing the path prefixes in disallow, or a 404 when
+    there are none. '''
+    def __init__(self, pages=5000, links_per_page=20, page_size=20000,
+                 duplicate_rate=0.05, trap_rate=0.02, trap_depth=50,
+                 missing_rate=0.01, seed=0, exact_duplicate_rate=0.02,
+                 disallow=()):
+        self.pages = pages
+        self.links_per_page = links_per_page
+        self.page_size = page_size
+        self.duplicate_rate = duplicate_rate
+        self.exact_duplicate_rate = exact_duplicate_rate
+        self.disallow = disallow
+        self.trap_rate = trap_rate
+        self.trap_depth = trap_depth
+        self.missing_rate = missing_rate
+        self.seed = seed
+        rng = random.Random(seed)
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        self.vocabulary = [
+            "".join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+            for _ in range(5000)]
+
+    def seed_urls(self):
+        return [f"https://{host}" for host in HOSTS]
+
+    def page_url(self, number):
+        return f"https://{HOSTS[number % len(HOSTS)]}/page/{number}"
+
+    def reply(self, url):
+        ''' (status, html) for a url, html is None for a 404. '''
+        parsed = urlparse(url)
+        path = parsed.path.rstrip("/")
+        rng = self._rng(url)
+        if path == "/robots.txt":
+            if not self.disallow:
+                return 404, None
+            return 200, "User-agent: *\n" + "".join(
+                f"Disallow: {prefix}\n" for prefix in self.disallow)
+        if path == "":
+            number = HOSTS.index(parsed.hostname) if parsed.hostname in HOSTS else 0
+        elif path.startswith("/page/") and path[6:].isdigit():
+            number = int(path[6:])
+            if number >= self.pages or rng.random() < self.missing_rate:
+                return 404, None
+        elif path.startswith("/list"):
+            depth = int(parse_qs(parsed.query).get("page", ["0"])[0])
+            if depth >= self.trap_depth:
+                return 404, None
+            return 200, self._html(
+                f"list {depth}", self._text(rng, self.page_size // 4),
+                [f"/list?page={depth + 1}"])
+        else:
+            # Trap pages that is_valid should never let through.
+            return 200, self._html("trap", self._text(rng, 200), [])
+        return 200, self._page(number)
+
+    def response(self, url):
+        ''' CBOR body of the cache server reply for url. '''
+        status, html = self.reply(url)
+        if html is None:
+            return cbor.dumps({
+                "url": url, "status": status,
+                "error": f"Page {url} does not exist"})
+        raw = requests.models.Response()
+        raw.status_code = status
+        raw.url = url
+        raw._content = html.encode("utf-8")
+        raw.headers["Content-Type"] = (
+            "text/plain; charset=utf-8" if url.endswith("/robots.txt")
+            else "text/html; charset=utf-8")
+        raw.encoding = "utf-8"
+        return cbor.dumps({
+            "url": url, "status": status,
+            "response": pickle.dumps(raw, pickle.HIGHEST_PROTOCOL)})
+
+    def _page(self, number):
+        rng = self._rng(number)
+        source = number
+        exact = False
+        if number >= len(HOSTS):
+            draw = rng.random()
+            if draw < self.duplicate_rate + self.exact_duplicate_rate:
+                source = rng.randrange(number)
+                exact = draw >= self.duplicate_rate
+        text_rng = self._rng(source)
+        words = self._text(text_rng, self.page_size).split(" ")
+        if source != number and not exact:
+            # A near duplicate: the same text with a few words changed.
+            for _ in range(max(1, len(words) // 200)):
+                words[rng.randrange(len(words))] = rng.choice(self.vocabulary)
+        links = [
+            self.page_url(rng.randrange(self.pages))
+            for _ in range(self.links_per_page)]
+        if rng.random() < self.trap_rate:
+            links.extend([
+                "/list?page=0",
+                f"/events/day/2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "/about/people/about/people/",
+                "/calendar/?month=5"])
+        title = f"page {source}" if exact else f"page {number}"
+        return self._html(title, " ".join(words), links)
+
+    def _text(self, rng, size):
+        words = list()
+        length = 0
+        while length < size:
+            word = rng.choice(self.vocabulary)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)
+
+    def _html(self, title, text, links):
+        anchors = "\n".join(f'<li><a href="{link}">link</a></li>' for link in links)
+        paragraphs = "\n".join(
+            f"<p>{text[i:i + 2000]}</p>" for i in range(0, len(text), 2000))
+        return (
+            f"<!DOCTYPE html>\n<html><head><title>{title}</title></head><body>\n"
+            f"<h1>{title}</h1>\n{paragraphs}\n<ul>\n{anchors}\n</ul>\n</body></html>")
+
+    def _rng(self, key):
+        digest = hashlib.sha256(f"{self.seed}/{key}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "little"))
+
+
+class FakeCacheServer(ThreadingHTTPServer):
+    ''' Serves a SiteGraph, waiting latency seconds before every reply. '''
+    daemon_threads = True
+
+    def __init__(self, graph, host="127.0.0.1", port=0, latency=0.0):
+        self.graph = graph
+        self.latency = latency
+        self.requests = 0
+        super().__init__((host, port), _CacheHandler)
+
+    @property
+    def address(self):
+        return self.server_address[0], self.server_address[1]
+
+    def start(self):
+        ''' Serves from a daemon thread. '''
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _CacheHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real server, so pooled sessions are reused.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        url = query.get("q", [""])[0]
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.requests += 1
+        body = self.server.graph.response(url)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def add_graph_arguments(parser):
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--links", type=int, default=20)
+    parser.add_argument("--page_size", type=int, default=20000)
+    parser.add_argument("--duplicate_rate", type=float, default=0.05)
+    parser.add_argument("--exact_duplicate_rate", type=float, default=0.02)
+    parser.add_argument("--trap_rate", type=float, default=0.02)
+    parser.add_argument("--trap_depth", type=int, default=50)
+    parser.add_argument("--missing_rate", type=float, default=0.01)
+    parser.add_argument("--disallow", type=str, default="",
+        help="comma separated path prefixes that robots.txt disallows")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def graph_from_arguments(args):
+    return SiteGraph(
+        args.pages, args.links, args.page_size, args.duplicate_rate,
+        args.trap_rate, args.trap_depth, args.missing_rate, args.seed,
+        args.exact_duplicate_rate,
+        tuple(prefix for prefix in args.disallow.split(",") if prefix))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_graph_arguments(parser)
+    args = parser.parse_args()
+    server = FakeCacheServer(
+        graph_from_arguments(args), args.host, args.port, args.latency)
+    print(f"Serving {args.pages} pages on {args.host}:{server.address[1]}")
+    server.serve_forever()
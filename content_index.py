@@ -0,0 +1,62 @@
+import os
+from hashlib import blake2b
+from threading import Lock
+
+import numpy as np
+
+from utils.append_log import AppendLog, append_file, read_records
+
+
+def content_hash(text):
+    ''' 64-bit hash of the visible text of a page, with runs of whitespace
+    collapsed, so copies that only differ in markup hash the same. '''
+    text = " ".join(text.split())
+    return int.from_bytes(
+        blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ContentHashIndex(object):
+    ''' Set of the content_hash of every page whose text was seen, to drop
+    exact copies before they are tokenized and fingerprinted. The hashes
+    are kept in a crawler.seen_urls.SeenUrls, 8 bytes per page, and an
+    AppendLog appends them to <path> as 8-byte records every flush_interval
+    seconds. '''
+    def __init__(self, path="content_hashes.bin", flush_interval=1.0):
+        # Imported here, the crawler package imports scraper, which imports
+        # this module.
+        from crawler.seen_urls import SeenUrls
+
+        # Absolute, the flush at exit may run after a change of directory.
+        self.path = os.path.abspath(path)
+        self._lock = Lock()
+        self._hashes = SeenUrls()
+        self._hashes.update_keys(
+            np.frombuffer(read_records(self.path, 8), dtype=np.uint64))
+        self._hashes.merge()
+        self._log = AppendLog(self._write, flush_interval)
+
+    @staticmethod
+    def remove(path="content_hashes.bin"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._hashes)
+
+    def add(self, value):
+        ''' Adds a hash and returns False if it was seen before. '''
+        with self._lock:
+            new = self._hashes.add_new([value])[0]
+        if new:
+            self._log.add(value)
+        return new
+
+    def close(self):
+        self._log.close()
+
+    def flush(self):
+        self._log.flush()
+
+    def _write(self, pending):
+        append_file(self.path, np.array(pending, dtype=np.uint64).tobytes())
@@ -1,18 +1,49 @@
 from utils import get_logger
+from utils.metrics import metrics, MetricsReporter
+import url_canon
+import scraper
+from utils.download import close_response_cache
 from crawler.frontier import Frontier
 from crawler.worker import Worker
+from crawler.async_worker import AsyncWorker
+from crawler.parse_pool import ParsePool
+from crawler.pipeline import Pipeline
+
+WORKERS = {
+    "sync": Worker,
+    "async": AsyncWorker,
+}
 
 class Crawler(object):
-    def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
+    def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=None):
         self.config = config
         self.logger = get_logger("CRAWLER")
+        url_canon.configure(config.strip_params)
+        if restart:
+            scraper.remove_saved_state()
         self.frontier = frontier_factory(config, restart)
         self.workers = list()
-        self.worker_factory = worker_factory
+        self.worker_factory = worker_factory or WORKERS.get(config.download_mode)
+        self.parse_pool = None
+        self.reporter = MetricsReporter(
+            metrics, config.metrics_file, config.metrics_interval,
+            config.metrics_port)
 
     def start_async(self):
+        self.reporter.start()
+        if self.config.download_mode == "pipeline":
+            # One pipeline runs every stage, THREADCOUNT is its number of
+            # fetch threads.
+            self.workers = [Pipeline(self.config, self.frontier)]
+            self.workers[0].start()
+            return
+        kwargs = dict()
+        if self.config.parse_processes:
+            # Workers hand their responses to parser processes.
+            self.parse_pool = kwargs["parse_pool"] = ParsePool(
+                self.config, self.frontier)
         self.workers = [
-            self.worker_factory(worker_id, self.config, self.frontier)
+            self.worker_factory(worker_id, self.config, self.frontier, **kwargs)
             for worker_id in range(self.config.threads_count)]
         for worker in self.workers:
             worker.start()
@@ -24,3 +55,9 @@ class Crawler(object):
     def join(self):
         for worker in self.workers:
             worker.join()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        self.frontier.close()
+        close_response_cache()
+        scraper.close_saved_state()
+        self.reporter.stop()
@@ -0,0 +1,65 @@
+import asyncio
+from threading import Thread
+
+from utils.download import download_async
+from utils import get_logger
+import scraper
+
+
+class AsyncWorker(Thread):
+    ''' Runs an asyncio event loop that keeps up to config.async_tasks
+    downloads in flight at once. Scraping runs in the loop's default
+    executor so parsing does not stall the downloads, or in the parse pool's
+    processes when there is one. '''
+    # Seconds to wait before asking the frontier again when no host is ready.
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, worker_id, config, frontier, parse_pool=None):
+        self.logger = get_logger(f"Worker-{worker_id}", "Worker")
+        self.config = config
+        self.frontier = frontier
+        self.parse_pool = parse_pool
+        super().__init__(daemon=True)
+
+    def run(self):
+        asyncio.run(self._crawl())
+        self.logger.info("Frontier is empty. Stopping Crawler.")
+
+    async def _crawl(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.config.async_tasks)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(*(
+                self._fetch_loop(session)
+                for _ in range(self.config.async_tasks)))
+
+    async def _fetch_loop(self, session):
+        loop = asyncio.get_running_loop()
+        while True:
+            tbd_url = self.frontier.get_tbd_url(timeout=0)
+            if not tbd_url:
+                if self.frontier.finished():
+                    break
+                await asyncio.sleep(self.POLL_INTERVAL)
+                continue
+            outcome = scraper.ERROR
+            try:
+                resp = await download_async(
+                    tbd_url, self.config, session, self.logger)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                if self.parse_pool is not None:
+                    # submit blocks while the parser processes are behind.
+                    await loop.run_in_executor(
+                        None, self.parse_pool.submit, tbd_url, resp)
+                    continue
+                parsed = await loop.run_in_executor(
+                    None, scraper.scrape_page, tbd_url, resp)
+                outcome = parsed.outcome
+                await loop.run_in_executor(
+                    None, self.frontier.add_urls, parsed.links, tbd_url)
+            except Exception as e:
+                self.logger.error(f"Failed to crawl {tbd_url}: {e!r}")
+            self.frontier.mark_url_complete(tbd_url, outcome)
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+
+from hashlib import blake2b
+from itertools import count
+from threading import Thread
+
+from utils import get_logger, get_urldigest
+from utils.metrics import metrics, merge_snapshots
+from url_canon import canonicalize
+from page_store import PageStore
+from crawler.frontier import Frontier, _get_host
+from crawler.seen_urls import SeenUrls, url_key
+
+# A partitioned crawl runs config.nodes crawlers, each started with
+# launch.py --node <n> in <CLUSTERDIR>/node-<n>. Every node owns the hosts
+# whose hash falls in its share of the hash range and has its own frontier,
+# politeness, near-duplicate index and page store. Links to hosts of other
+# nodes go through the spool directory <CLUSTERDIR>/spool, which the nodes
+# share, so they can run on one machine or on several with a shared file
+# system.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINKS_SUFFIX = ".links"
+
+
+def node_of(host, nodes):
+    ''' The node that owns host. '''
+    digest = blake2b(host.encode("utf-8"), digest_size=8).digest()
+    return (int.from_bytes(digest, "big") * nodes) >> 64
+
+
+def node_dir(config, node):
+    return os.path.join(config.cluster_dir, f"node-{node}")
+
+
+def spool_dir(config):
+    return os.path.join(config.cluster_dir, "spool")
+
+
+class Spool(object):
+    ''' The spool directory as seen by one node. <spool>/<n> is the inbox of
+    node n: a file of links is written under a temporary name and renamed,
+    so readers only see whole files. <spool>/idle/<n> exists while node n
+    has nothing to crawl, and holds the number of times it became idle. '''
+    def __init__(self, path, node, nodes):
+        self.path = path
+        self.node = node
+        self.nodes = nodes
+        self.inbox = os.path.join(path, str(node))
+        self.idle_dir = os.path.join(path, "idle")
+        for n in range(nodes):
+            os.makedirs(os.path.join(path, str(n)), exist_ok=True)
+        os.makedirs(self.idle_dir, exist_ok=True)
+        self.sequence = count()
+        self.idle = False
+        self.generation = 0
+        # A marker left by an earlier run is stale.
+        self.set_busy()
+
+    def send(self, node, records):
+        name = f"{self.node}-{time.time_ns()}-{next(self.sequence)}"
+        tmp = os.path.join(self.path, str(node), name + ".tmp")
+        with open(tmp, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp, tmp[:-len(".tmp")] + LINKS_SUFFIX)
+
+    def pending(self):
+        ''' Paths of the files in the inbox, oldest first. '''
+        return sorted(
+            os.path.join(self.inbox, name) for name in os.listdir(self.inbox)
+            if name.endswith(LINKS_SUFFIX))
+
+    def read(self, path):
+        records = list()
+        with open(path) as f:
+            for line in f:
+                records.append(json.loads(line))
+        return records
+
+    def set_idle(self):
+        if self.idle:
+            return
+        self.generation += 1
+        marker = os.path.join(self.idle_dir, str(self.node))
+        with open(marker + ".tmp", "w") as f:
+            f.write(str(self.generation))
+        os.replace(marker + ".tmp", marker)
+        self.idle = True
+
+    def set_busy(self):
+        try:
+            os.remove(os.path.join(self.idle_dir, str(self.node)))
+        except FileNotFoundError:
+            pass
+        self.idle = False
+
+    def quiescent(self):
+        ''' True once every node is idle and no links are in flight. A node
+        stops being idle before it takes a file from its inbox, so reading
+        the markers again after the inboxes catches every node that took
+        one in between. '''
+        before = self._markers()
+        if len(before) < self.nodes:
+            return False
+        for node in range(self.nodes):
+            inbox = os.path.join(self.path, str(node))
+            if any(name.endswith(LINKS_SUFFIX) for name in os.listdir(inbox)):
+                return False
+        return self._markers() == before
+
+    def _markers(self):
+        markers = dict()
+        for node in range(self.nodes):
+            try:
+                with open(os.path.join(self.idle_dir, str(node))) as f:
+                    markers[node] = f.read()
+            except FileNotFoundError:
+                pass
+        return markers
+
+
+class PartitionedFrontier(Frontier):
+    ''' Frontier of one node of a partitioned crawl. Links to hosts of other
+    nodes are forwarded to their owner instead of being queued, and the
+    links forwarded to this node are queued as if they were found here. The
+    crawl ends when every node is done, since another node can still send
+    links until then. A link is forwarded once per run; the owner counts
+    the repeats of the ones it knows from its own pages only. '''
+    # Seconds between looks at the inbox, and at most between a link being
+    # found and it being forwarded.
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, config, restart):
+        self.node = config.node_id
+        self.nodes = config.nodes
+        self.owners = dict()
+        # node -> records to forward, sent by the exchange thread.
+        self.outbox = dict()
+        self.forwarded = SeenUrls()
+        self.done = False
+        self.spool = Spool(os.path.abspath(config.spool_dir), self.node, self.nodes)
+        super().__init__(config, restart)
+        self.exchange = Thread(target=self._exchange, daemon=True)
+        self.exchange.start()
+
+    def finished(self):
+        with self.lock:
+            return self.done
+
+    def add_urls(self, urls, source=None):
+        own = list()
+        foreign = list()
+        for url in urls:
+            node = self._owner(canonicalize(url))
+            if node == self.node:
+                own.append(url)
+            elif source is not None:
+                # Every node is given all the seeds and keeps its own.
+                foreign.append((node, url))
+        if foreign:
+            self._forward(foreign, source)
+        if own or source is None:
+            super().add_urls(own, source)
+
+    def close(self):
+        super().close()
+        self.logger.info(
+            f"Node {self.node} forwarded {len(self.forwarded)} urls to other nodes.")
+
+    def _owner(self, url):
+        host = _get_host(url)
+        node = self.owners.get(host)
+        if node is None:
+            node = self.owners[host] = node_of(host, self.nodes)
+        return node
+
+    def _forward(self, foreign, source):
+        keys = [url_key(get_urldigest(canonicalize(url))) for _, url in foreign]
+        with self.lock:
+            depth, source_host, source_cost = self._link_origin(source)
+            forwarded = 0
+            for (node, url), new in zip(foreign, self.forwarded.add_new(keys)):
+                if new:
+                    self.outbox.setdefault(node, list()).append(
+                        [url, depth, source_host, source_cost])
+                    forwarded += 1
+        metrics.incr("links_forwarded", forwarded)
+
+    def _receive(self, records):
+        # Links that came from one page share their origin.
+        origins = dict()
+        for url, *origin in records:
+            origins.setdefault(tuple(origin), list()).append(url)
+        with metrics.timer("frontier_add"):
+            for (depth, source_host, source_cost), urls in origins.items():
+                digests, spellings = self._digest_urls(urls)
+                with self.lock:
+                    self._add_links(
+                        digests, spellings, depth, source_host, source_cost)
+        metrics.incr("links_received", len(records))
+
+    def _exchange(self):
+        # Sends the outbox, queues what arrived in the inbox, and ends the
+        # crawl once the spool shows that every node is done.
+        try:
+            while True:
+                with self.lock:
+                    if self.closed:
+                        return
+                paths = self.spool.pending()
+                if paths:
+                    self.spool.set_busy()
+                    for path in paths:
+                        self._receive(self.spool.read(path))
+                        os.remove(path)
+                with self.lock:
+                    outbox, self.outbox = self.outbox, dict()
+                    idle = (
+                        not paths and not outbox
+                        and Frontier.finished(self))
+                for node, records in outbox.items():
+                    self.spool.send(node, records)
+                if idle:
+                    self.spool.set_idle()
+                    if self.spool.quiescent():
+                        break
+                time.sleep(self.POLL_INTERVAL)
+        except Exception as e:
+            self.logger.error(f"Failed to exchange links: {e!r}")
+        with self.lock:
+            self.done = True
+            self.has_work.notify_all()
+
+
+def enter_node(config, node):
+    ''' Turns config into the config of node, and moves into its directory,
+    so the save file, page store, indexes and logs are its own. '''
+    assert 0 <= node < config.nodes, f"Node should be between 0 and {config.nodes - 1}"
+    config.node_id = node
+    config.spool_dir = os.path.abspath(spool_dir(config))
+    if config.metrics_port:
+        config.metrics_port += node
+    path = node_dir(config, node)
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+
+
+def run_nodes(config_file, config, restart):
+    ''' Starts a launch.py --node process for every node, waits for them
+    and merges their results. A restart also clears the spool. '''
+    logger = get_logger("CLUSTER")
+    if restart:
+        shutil.rmtree(spool_dir(config), ignore_errors=True)
+    command = [
+        sys.executable, os.path.join(ROOT, "launch.py"),
+        "--config_file", os.path.abspath(config_file)]
+    if restart:
+        command.append("--restart")
+    if config.replay:
+        command.append("--replay")
+    processes = [
+        subprocess.Popen(command + ["--node", str(node)])
+        for node in range(config.nodes)]
+    for node, process in enumerate(processes):
+        if process.wait():
+            logger.error(f"Node {node} exited with status {process.returncode}.")
+    merge(config)
+
+
+def merge(config):
+    ''' Merges the page stores of the nodes into <CLUSTERDIR>/pages, which
+    report.py --store reads like the store of a single crawler, and their
+    metrics into <CLUSTERDIR>/metrics.json. '''
+    logger = get_logger("CLUSTER")
+    target = os.path.join(config.cluster_dir, "pages")
+    shutil.rmtree(target, ignore_errors=True)
+    store = PageStore(target)
+    snapshots = list()
+    for node in range(config.nodes):
+        path = node_dir(config, node)
+        store.append_store(PageStore(os.path.join(path, "pages")))
+        metrics_file = os.path.join(path, config.metrics_file)
+        if config.metrics_file.endswith(".json") and os.path.exists(metrics_file):
+            with open(metrics_file) as f:
+                snapshots.append(json.load(f))
+    if snapshots:
+        with open(os.path.join(config.cluster_dir, "metrics.json"), "w") as f:
+            json.dump(merge_snapshots(snapshots), f, indent=1, sort_keys=True)
+    logger.info(
+        f"Merged the page stores of {config.nodes} nodes into {target} and "
+        f"the metrics of {len(snapshots)}.")
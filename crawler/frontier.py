@@ -1,72 +1,509 @@
-import os
-import shelve
-
-from threading import Thread, RLock
-from queue import Queue, Empty
-
-from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
-
-class Frontier(object):
-    def __init__(self, config, restart):
-        self.logger = get_logger("FRONTIER")
-        self.config = config
-        self.to_be_downloaded = list()
-        
-        if not os.path.exists(self.config.save_file) and not restart:
-            # Save file does not exist, but request to load save.
-            self.logger.info(
-                f"Did not find save file {self.config.save_file}, "
-                f"starting from seed.")
-        elif os.path.exists(self.config.save_file) and restart:
-            # Save file does exists, but request to start from seed.
-            self.logger.info(
-                f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
-        # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
-        if restart:
-            for url in self.config.seed_urls:
-                self.add_url(url)
-        else:
-            # Set the frontier state with contents of save file.
-            self._parse_save_file()
-            if not self.save:
-                for url in self.config.seed_urls:
-                    self.add_url(url)
-
-    def _parse_save_file(self):
-        ''' This function can be overridden for alternate saving techniques. '''
-        total_count = len(self.save)
-        tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
-        self.logger.info(
-            f"Found {tbd_count} urls to be downloaded from {total_count} "
-            f"total urls discovered.")
-
-    def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
-
-    def add_url(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
-    
-    def mark_url_complete(self, url):
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
-
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+import os
+import time
+import heapq
+
+from itertools import count
+from threading import Thread, RLock, Condition
+from queue import Queue, Empty
+from urllib.parse import urlparse
+
+from utils import get_logger, get_urldigest, normalize
+from utils.metrics import metrics
+import url_filter
+from url_filter import filter_urls
+from robots import RobotsCache
+from url_canon import canonicalize
+from crawler.store import get_store_class
+from crawler.seen_urls import SeenUrls, url_key
+from crawler.traps import TrapDetector
+
+class Frontier(object):
+    # Pending urls read from the save file at a time on resume.
+    RESUME_BATCH = 1000
+    # Parts of the priority of a url, the lowest is fetched first. Every
+    # link from the seeds costs DEPTH_WEIGHT, every doubling of the links
+    # to the url seen while it is queued gains INLINK_WEIGHT, a link from
+    # another host gains HOST_WEIGHT, and a low yield of the linking host
+    # and of the url's template (see crawler/traps.py) costs up to
+    # YIELD_WEIGHT each.
+    DEPTH_WEIGHT = 1.0
+    INLINK_WEIGHT = 0.5
+    HOST_WEIGHT = 0.5
+    YIELD_WEIGHT = 2.0
+
+    def __init__(self, config, restart):
+        self.logger = get_logger("FRONTIER")
+        self.config = config
+        # Politeness is enforced per host: every host has its own heap of
+        # (priority, sequence, url), and hosts with queued urls sit in a
+        # heap keyed on the earliest time they may be fetched again. Once
+        # that time has come they move to a heap of (priority of their best
+        # url, sequence, host), and the best of those is fetched next, so
+        # the order is best-first across hosts.
+        self.lock = RLock()
+        self.has_work = Condition(self.lock)
+        self.host_queues = dict()
+        self.host_heap = list()
+        self.ready_heap = list()
+        # host -> priority of the entry in ready_heap that counts, the
+        # others are skipped like the stale entries of the host heaps.
+        self.ready_hosts = dict()
+        self.next_fetch = dict()
+        self.busy_hosts = set()
+        self.queued = 0
+        # url -> [priority, priority without in-links, depth, in-links] of
+        # every queued url. A url whose priority changes is pushed again,
+        # and heap entries that do not match this are skipped.
+        self.queued_urls = dict()
+        # url -> depth of the urls being downloaded.
+        self.in_flight = dict()
+        self.sequence = count()
+        # Set while the pending urls of the save file are still being
+        # queued, see _parse_save_file.
+        self.loading = False
+        self.loader = None
+        self.added_while_loading = set()
+        self.closed = False
+        # Keys of the urls in the save file, so repeated links are rejected
+        # without asking the store. Rebuilt after a resume, see _load_pending.
+        self.seen = SeenUrls()
+        # Keys of the spellings of urls that canonicalize rewrote, to count
+        # the fetches it saved over keying on the spelling.
+        self.rewritten = SeenUrls()
+        self.canonical_duplicates = 0
+        metrics.gauge("frontier_size", lambda: self.queued)
+        metrics.gauge("frontier_hosts", lambda: len(self.host_queues))
+        metrics.gauge("seen_urls_bytes", lambda: self.seen.nbytes)
+
+        store_class = get_store_class(self.config)
+        if not os.path.exists(self.config.save_file) and not restart:
+            # Save file does not exist, but request to load save.
+            self.logger.info(
+                f"Did not find save file {self.config.save_file}, "
+                f"starting from seed.")
+        elif os.path.exists(self.config.save_file) and restart:
+            # Save file does exists, but request to start from seed.
+            self.logger.info(
+                f"Found save file {self.config.save_file}, deleting it.")
+            store_class.remove(self.config.save_file)
+        # Load existing save file, or create one if it does not exist.
+        self.save = store_class(
+            self.config.save_file, self.config.commit_interval)
+        # Yield of every url template, urls of blocked templates are pruned.
+        self.traps = TrapDetector(self.config, restart)
+        self.pruned = 0
+        # A host is only scheduled once its robots.txt is here, so no url it
+        # disallows is fetched. Hosts waiting for it are in robots_pending.
+        self.robots = None
+        self.robots_pending = set()
+        self.crawl_delays = dict()
+        self.disallowed = 0
+        if self.config.obey_robots:
+            self.robots = RobotsCache(self.config, self._robots_ready)
+            url_filter.use_robots(self.robots)
+        # The store, the trap detector and the robots cache save when they
+        # are written to once the interval is up, this saves what the last
+        # writes before a pause left behind.
+        self.committer = None
+        if self.config.commit_interval > 0:
+            self.committer = Thread(target=self._commit_loop, daemon=True)
+            self.committer.start()
+        if restart:
+            self.add_urls(self.config.seed_urls)
+        else:
+            # Set the frontier state with contents of save file.
+            self._parse_save_file()
+            with self.lock:
+                empty = not self.save
+            if empty:
+                self.add_urls(self.config.seed_urls)
+
+    def _parse_save_file(self):
+        ''' This function can be overridden for alternate saving techniques.
+        Reads only the urls still to be downloaded. The first batch is
+        queued here and a loader thread queues the rest, so the crawl starts
+        without waiting for the whole save file. '''
+        start = time.time()
+        self.loading = True
+        batches = self.save.pending_batches(self.RESUME_BATCH)
+        tbd_count = self._load_batch(batches)
+        self.logger.info(
+            f"Queued the first {tbd_count or 0} urls to be downloaded in "
+            f"{time.time() - start:.2f}s, loading the rest in the background.")
+        self.loader = Thread(
+            target=self._load_pending, args=(batches, start, tbd_count or 0),
+            daemon=True)
+        self.loader.start()
+
+    def _load_pending(self, batches, start, tbd_count):
+        try:
+            while True:
+                count = self._load_batch(batches)
+                if count is None:
+                    break
+                tbd_count += count
+        except Exception as e:
+            self.logger.error(f"Failed to load the save file: {e!r}")
+        with self.lock:
+            self.loading = False
+            self.added_while_loading = set()
+            # Waiters may be blocked on the frontier not being finished.
+            self.has_work.notify_all()
+        self.logger.info(
+            f"Found {tbd_count} urls to be downloaded, resumed in "
+            f"{time.time() - start:.2f}s.")
+        try:
+            self._rebuild_seen()
+        except Exception as e:
+            self.logger.error(f"Failed to rebuild the seen urls: {e!r}")
+
+    def _rebuild_seen(self):
+        # Until the keys are merged, urls missing from self.seen are looked
+        # up in the store as before.
+        start = time.time()
+        batches = self.save.hash_batches(self.RESUME_BATCH * 10)
+        while True:
+            with self.lock:
+                if self.closed:
+                    return
+                hashes = next(batches, None)
+                if hashes is None:
+                    self.seen.merge()
+                    break
+                self.seen.update(hashes)
+        self.logger.info(
+            f"Loaded {len(self.seen)} seen urls in {time.time() - start:.2f}s, "
+            f"{self.seen.nbytes / 2 ** 20:.1f} MiB.")
+
+    def _commit_loop(self):
+        while True:
+            time.sleep(self.config.commit_interval)
+            with self.lock:
+                if self.closed:
+                    return
+                self.save.commit()
+                self.traps.save()
+                if self.robots is not None:
+                    self.robots.commit()
+
+    def _load_batch(self, batches):
+        ''' Queues the next batch of pending urls and returns how many were
+        queued, or None when there are no more. '''
+        with self.lock:
+            if self.closed:
+                return None
+            entries = next(batches, None)
+        if entries is None:
+            return None
+        valid = set(filter_urls([url for url, _, _ in entries]))
+        with self.lock:
+            # A url added since the resume started is queued already.
+            entries = [
+                entry for entry in entries
+                if entry[0] in valid and entry[0] not in self.added_while_loading]
+            for url, depth, priority in entries:
+                self._enqueue(url, depth, priority)
+        return len(entries)
+
+    def get_tbd_url(self, timeout=None):
+        ''' Blocks until some host is allowed to be fetched again and returns
+        one of its urls. Returns None once nothing is queued and no download
+        is in flight that could still add urls, or when timeout seconds pass
+        without a host becoming ready (see finished). frontier_pop times
+        taking a url off the heaps, frontier_wait the time spent waiting for
+        a host. '''
+        return self._get_tbd_url(timeout)
+
+    def _get_tbd_url(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            while True:
+                now = time.time()
+                while self.host_heap and self.host_heap[0][0] <= now:
+                    self._set_ready(heapq.heappop(self.host_heap)[1])
+                if self.ready_hosts:
+                    with metrics.timer("frontier_pop"):
+                        host = self._pop_ready_host()
+                        url = self._pop_admitted(host)
+                    if url is None:
+                        # Every queued url of the host was pruned.
+                        continue
+                    self.busy_hosts.add(host)
+                    return url
+                if self.finished():
+                    return None
+                wait = self.host_heap[0][0] - now if self.host_heap else None
+                if deadline is not None:
+                    if deadline <= now:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                with metrics.timer("frontier_wait"):
+                    self.has_work.wait(wait)
+
+    def finished(self):
+        ''' True once no url is queued and no download is in flight. '''
+        with self.lock:
+            return (
+                not self.loading and not self.host_heap and not self.ready_hosts
+                and not self.busy_hosts and not self.robots_pending)
+
+    def add_url(self, url, source=None):
+        self.add_urls([url], source)
+
+    def add_urls(self, urls, source=None):
+        ''' Adds the links found on the page at source, or seed urls when
+        source is None. '''
+        with metrics.timer("frontier_add"):
+            digests, spellings = self._digest_urls(urls)
+            with self.lock:
+                self._add_links(digests, spellings, *self._link_origin(source))
+
+    def _digest_urls(self, urls):
+        # (digest, canonical url) of every url, and (index, key) of the
+        # spellings that canonicalize rewrote.
+        digests = list()
+        spellings = list()
+        for url in urls:
+            canonical = canonicalize(url)
+            digests.append((get_urldigest(canonical), canonical))
+            spelling = normalize(url)
+            if spelling != canonical:
+                spellings.append(
+                    (len(digests) - 1, url_key(get_urldigest(spelling))))
+        return digests, spellings
+
+    def _link_origin(self, source):
+        # (depth, host, cost) that the links found on source inherit.
+        if source is None:
+            return 0, None, 0.0
+        source_host = _get_host(source)
+        return (
+            self.in_flight.get(source, 0) + 1, source_host,
+            self.YIELD_WEIGHT * (1 - self.traps.host_yield(source_host)))
+
+    def _add_links(self, digests, spellings, depth, source_host, source_cost):
+        fresh = self.seen.add_new([url_key(digest) for digest, _ in digests])
+        metrics.incr("seen_url_hits", fresh.count(False))
+        entries = dict()
+        linked = set()
+        pruned = 0
+        disallowed = 0
+        for (digest, url), new in zip(digests, fresh):
+            if not new:
+                entry = self.queued_urls.get(url)
+                if entry is not None and url not in linked:
+                    linked.add(url)
+                    self._add_inlink(digest, url, entry)
+                continue
+            if self.robots is not None and not self.robots.allowed(url):
+                disallowed += 1
+                continue
+            template_yield = self.traps.template_yield(url)
+            if template_yield is None:
+                # Urls of blocked templates are not stored at all.
+                pruned += 1
+                continue
+            priority = (
+                self.DEPTH_WEIGHT * depth + source_cost
+                + self.YIELD_WEIGHT * (1 - template_yield))
+            if source_host is not None and _get_host(url) != source_host:
+                priority -= self.HOST_WEIGHT
+            entries[url] = (digest.hex(), url, depth, priority)
+        self._count_pruned(pruned)
+        self._count_disallowed(disallowed)
+        added = self.save.add_urls(list(entries.values()))
+        for url in added:
+            if self.loading:
+                self.added_while_loading.add(url)
+            self._enqueue(url, depth, entries[url][3])
+        if spellings:
+            self._count_rewritten(digests, fresh, set(added), spellings)
+
+    def _count_rewritten(self, digests, fresh, added, spellings):
+        # A spelling that was new would have been fetched when urls were
+        # keyed on their spelling. It was saved if its canonical url was not.
+        new_spellings = self.rewritten.add_new([key for _, key in spellings])
+        saved = 0
+        for (i, _), new_spelling in zip(spellings, new_spellings):
+            if new_spelling and not (fresh[i] and digests[i][1] in added):
+                saved += 1
+        metrics.incr("links_canonicalized", len(spellings))
+        if saved:
+            self.canonical_duplicates += saved
+            metrics.incr("canonical_duplicates", saved)
+
+    def mark_url_complete(self, url, outcome=None):
+        ''' outcome is the scraper's verdict on the page (see
+        scraper.ParsedPage), used to judge the yield of its template. '''
+        digest = get_urldigest(url)
+        with self.lock:
+            self.in_flight.pop(url, None)
+            if outcome is not None:
+                self.traps.record(url, outcome)
+            self.seen.add_new([url_key(digest)])
+            if not self.save.mark_complete(digest.hex(), url):
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+            self._release_host(_get_host(url))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.save.close()
+            self.traps.close()
+            if self.robots is not None:
+                self.robots.close()
+                url_filter.use_robots(None)
+        self.logger.info(
+            f"Canonicalization saved {self.canonical_duplicates} duplicate "
+            f"fetches.")
+        self.logger.info(f"Pruned {self.pruned} urls of blocked url templates.")
+        self.logger.info(f"Dropped {self.disallowed} urls disallowed by robots.txt.")
+
+    def _pop_admitted(self, host):
+        # The best url of the host that the trap detector lets through.
+        # Pruned urls are marked complete, so a resume does not queue them.
+        queue = self.host_queues[host]
+        url = None
+        while queue:
+            priority, _, candidate = heapq.heappop(queue)
+            entry = self.queued_urls.get(candidate)
+            if entry is None or entry[0] != priority:
+                # Pushed again with another priority, or already popped.
+                continue
+            del self.queued_urls[candidate]
+            self.queued -= 1
+            if self.robots is not None and not self.robots.allowed(candidate):
+                # Queued before the robots.txt of its host was here.
+                self.save.mark_complete(get_urldigest(candidate).hex(), candidate)
+                self._count_disallowed(1)
+                continue
+            if self.traps.admit(candidate):
+                url = candidate
+                self.in_flight[url] = entry[2]
+                if self.robots is not None:
+                    # Refreshes the rules once they are too old.
+                    self.robots.request(url)
+                break
+            self.save.mark_complete(get_urldigest(candidate).hex(), candidate)
+            self._count_pruned(1)
+        if not queue:
+            del self.host_queues[host]
+        return url
+
+    def _set_ready(self, host):
+        # (Re)enters a host that may be fetched now under the priority of its
+        # best queued url.
+        priority = self._head_priority(host)
+        self.ready_hosts[host] = priority
+        heapq.heappush(self.ready_heap, (priority, next(self.sequence), host))
+
+    def _pop_ready_host(self):
+        while True:
+            priority, _, host = heapq.heappop(self.ready_heap)
+            if self.ready_hosts.get(host) == priority:
+                del self.ready_hosts[host]
+                return host
+
+    def _head_priority(self, host):
+        # Drops the stale entries at the top of the host's heap, so its first
+        # entry is its best queued url.
+        queue = self.host_queues.get(host)
+        while queue:
+            priority, _, url = queue[0]
+            entry = self.queued_urls.get(url)
+            if entry is not None and entry[0] == priority:
+                return priority
+            heapq.heappop(queue)
+        return float("inf")
+
+    def _count_pruned(self, count):
+        if count:
+            self.pruned += count
+            metrics.incr("trap_pruned", count)
+
+    def _count_disallowed(self, count):
+        if count:
+            self.disallowed += count
+            metrics.incr("robots_disallowed", count)
+
+    def _enqueue(self, url, depth=0, priority=0.0):
+        host = _get_host(url)
+        with self.lock:
+            queue = self.host_queues.get(host)
+            if queue is None:
+                queue = self.host_queues[host] = list()
+                if self.robots is not None:
+                    self.robots.request(url)
+                if host not in self.busy_hosts:
+                    self._schedule_host(host)
+            self.queued_urls[url] = [priority, priority, depth, 0]
+            heapq.heappush(queue, (priority, next(self.sequence), url))
+            self.queued += 1
+            if priority < self.ready_hosts.get(host, priority):
+                self._set_ready(host)
+
+    def _add_inlink(self, digest, url, entry):
+        # In-links only move a url up at every doubling, so a popular url is
+        # pushed again and saved a few times rather than once per link.
+        entry[3] += 1
+        priority = entry[1] - self.INLINK_WEIGHT * entry[3].bit_length()
+        if priority != entry[0]:
+            entry[0] = priority
+            host = _get_host(url)
+            heapq.heappush(
+                self.host_queues[host], (priority, next(self.sequence), url))
+            self.save.set_priority(digest.hex(), priority)
+            if priority < self.ready_hosts.get(host, priority):
+                self._set_ready(host)
+
+    def _release_host(self, host):
+        # The host becomes fetchable again one politeness delay after its
+        # previous download finished.
+        if host not in self.busy_hosts:
+            return
+        self.busy_hosts.discard(host)
+        self.next_fetch[host] = time.time() + self._delay(host)
+        if host in self.host_queues:
+            self._schedule_host(host)
+        else:
+            # Waiters may be blocked on this being the last busy host.
+            self.has_work.notify_all()
+
+    def _schedule_host(self, host):
+        if self.robots is not None and not self.robots.known(host):
+            # _robots_ready schedules it.
+            self.robots_pending.add(host)
+            return
+        heapq.heappush(self.host_heap, (self.next_fetch.get(host, 0), host))
+        self.has_work.notify_all()
+
+    def _delay(self, host):
+        # POLITENESS, or the host's Crawl-delay if that is longer. A replay
+        # downloads nothing, so it has none.
+        if self.config.replay:
+            return 0.0
+        return max(self.config.time_delay, self.crawl_delays.get(host, 0))
+
+    def _robots_ready(self, host, crawl_delay):
+        # Called by the robots cache when the robots.txt of host arrived.
+        with self.lock:
+            if crawl_delay is None:
+                self.crawl_delays.pop(host, None)
+            else:
+                self.crawl_delays[host] = crawl_delay
+            if host not in self.robots_pending:
+                return
+            self.robots_pending.discard(host)
+            # Fetching the robots.txt counts as a download from the host.
+            self.next_fetch[host] = time.time() + self._delay(host)
+            if host in self.host_queues and host not in self.busy_hosts:
+                self._schedule_host(host)
+            else:
+                # Waiters may be blocked on this being the last pending host.
+                self.has_work.notify_all()
+
+
+def _get_host(url):
+    return (urlparse(url).hostname or "").lower()
@@ -0,0 +1,91 @@
+import time
+
+from queue import Queue
+from threading import Thread, BoundedSemaphore
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from requests.structures import CaseInsensitiveDict
+
+from utils import get_logger
+from utils.metrics import metrics
+import scraper
+import url_canon
+
+
+def picklable_response(resp):
+    ''' Makes a Response safe to send to a parser process. A page that was
+    not read yet travels still pickled and is unpickled in the parser. '''
+    if resp.headers is not None:
+        # aiohttp's header proxies can not be pickled.
+        resp.headers = CaseInsensitiveDict(resp.headers)
+    return resp
+
+
+class ParsePool(object):
+    ''' Runs scraper.parse_page, the CPU-heavy half of scraper.scraper, in
+    config.parse_processes parser processes. Workers only download and hand
+    the response to submit. Results come back to a single coordinator thread
+    in this process, which checks the fingerprint against the simhash index,
+    stores the page, adds the links to the frontier and then marks the url
+    complete, so the frontier and index are only changed from here. '''
+    # Responses that may wait for a parser process, per process. submit
+    # blocks once they are all taken, which holds back the downloads.
+    BACKLOG_PER_PROCESS = 4
+
+    def __init__(self, config, frontier):
+        self.logger = get_logger("PARSER")
+        self.frontier = frontier
+        # spawn, because forking would copy the locks held by the threads
+        # of this process.
+        self.executor = ProcessPoolExecutor(
+            config.parse_processes, mp_context=get_context("spawn"),
+            initializer=url_canon.configure, initargs=(config.strip_params,))
+        self.slots = BoundedSemaphore(
+            config.parse_processes * self.BACKLOG_PER_PROCESS)
+        self.results = Queue()
+        metrics.gauge("parse_backlog", self.results.qsize)
+        self.coordinator = Thread(target=self._coordinate, daemon=True)
+        self.coordinator.start()
+
+    def submit(self, url, resp):
+        self.slots.acquire()
+        start = time.perf_counter()
+        try:
+            future = self.executor.submit(
+                scraper.parse_page, url, picklable_response(resp))
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future: self._done(url, future, start))
+
+    def close(self):
+        ''' Waits for the submitted pages and stops the parser processes and
+        the coordinator. '''
+        # Done callbacks have all run once the executor is shut down.
+        self.executor.shutdown(wait=True)
+        self.results.put(None)
+        self.coordinator.join()
+
+    def _done(self, url, future, start):
+        # Parse timings recorded in the parser processes are not reported,
+        # this covers the whole round trip.
+        metrics.observe("parse_process", time.perf_counter() - start)
+        self.results.put((url, future))
+
+    def _coordinate(self):
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+            url, future = item
+            outcome = scraper.ERROR
+            try:
+                parsed = scraper.record_page(url, future.result())
+                outcome = parsed.outcome
+                self.frontier.add_urls(parsed.links, url)
+            except Exception as e:
+                self.logger.error(f"Failed to parse {url}: {e!r}")
+            finally:
+                self.slots.release()
+                self.frontier.mark_url_complete(url, outcome)
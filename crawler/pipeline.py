@@ -0,0 +1,149 @@
+from queue import Queue
+from threading import Thread, Event
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.download import download
+from utils import get_logger
+from utils.metrics import metrics
+from crawler.parse_pool import picklable_response
+import scraper
+import url_canon
+
+# Stages after fetch, each fed by its own bounded queue.
+STAGES = ("extract", "dedupe", "store", "frontier")
+
+
+class Pipeline(object):
+    ''' Crawls with a pool of threads per stage, connected by bounded queues:
+
+        fetch -> extract -> dedupe -> store
+                                   -> frontier
+
+    fetch downloads (config.threads_count threads), extract runs
+    scraper.parse_page, dedupe checks the fingerprint against the simhash
+    index, store writes the page to the page store and frontier adds the
+    links and marks the url complete. A full queue blocks the stage that
+    feeds it, so a slow disk or simhash step holds back the downloads
+    instead of piling up pages in memory. '''
+    # Seconds between log lines with the queue depths.
+    REPORT_INTERVAL = 30
+
+    def __init__(self, config, frontier):
+        self.logger = get_logger("PIPELINE")
+        self.config = config
+        self.frontier = frontier
+        self.queues = {stage: Queue(config.queue_size) for stage in STAGES}
+        for stage, queue in self.queues.items():
+            metrics.gauge(f"queue_{stage}", queue.qsize)
+        self.parser = None
+        if config.parse_processes:
+            # extract threads wait on parser processes instead of parsing.
+            self.parser = ProcessPoolExecutor(
+                config.parse_processes, mp_context=get_context("spawn"),
+                initializer=url_canon.configure,
+                initargs=(config.strip_params,))
+        self.threads = {"fetch": [
+            Thread(target=self._fetch, daemon=True)
+            for _ in range(config.threads_count)]}
+        for stage in STAGES:
+            self.threads[stage] = [
+                Thread(target=self._run_stage, args=(stage,), daemon=True)
+                for _ in range(config.stage_threads[stage])]
+        self.stopped = Event()
+        self.reporter = Thread(target=self._report, daemon=True)
+
+    def start(self):
+        for threads in self.threads.values():
+            for thread in threads:
+                thread.start()
+        self.reporter.start()
+
+    def join(self):
+        for thread in self.threads["fetch"]:
+            thread.join()
+        # The fetch threads stop once every url is marked complete, so only
+        # the store stage can still have work. Stop the stages in order.
+        for stage in STAGES:
+            for _ in self.threads[stage]:
+                self.queues[stage].put(None)
+            for thread in self.threads[stage]:
+                thread.join()
+        if self.parser is not None:
+            self.parser.shutdown()
+        self.stopped.set()
+        self.reporter.join()
+
+    def queue_depths(self):
+        return {stage: queue.qsize() for stage, queue in self.queues.items()}
+
+    def _fetch(self):
+        while True:
+            tbd_url = self.frontier.get_tbd_url()
+            if not tbd_url:
+                self.logger.info("Frontier is empty. Stopping Crawler.")
+                break
+            try:
+                resp = download(tbd_url, self.config, self.logger)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+            except Exception as e:
+                self.logger.error(f"Failed to fetch {tbd_url}: {e!r}")
+                self.queues["frontier"].put((tbd_url, None))
+                continue
+            self.queues["extract"].put((tbd_url, resp))
+
+    def _run_stage(self, stage):
+        handle = getattr(self, f"_{stage}")
+        queue = self.queues[stage]
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            url, value = item
+            try:
+                handle(url, value)
+            except Exception as e:
+                self.logger.error(f"Failed to {stage} {url}: {e!r}")
+                if stage in ("extract", "dedupe"):
+                    # The url still has to be marked complete.
+                    self.queues["frontier"].put((url, None))
+
+    def _extract(self, url, resp):
+        if self.parser is not None:
+            with metrics.timer("parse_process"):
+                parsed = self.parser.submit(
+                    scraper.parse_page, url, picklable_response(resp)).result()
+        else:
+            parsed = scraper.parse_page(url, resp, scraper.get_content_index())
+        self.queues["dedupe"].put((url, parsed))
+
+    def _dedupe(self, url, parsed):
+        outcome = parsed.outcome
+        if parsed.tokens is not None:
+            if scraper.is_exact_duplicate(url, parsed):
+                outcome = scraper.EXACT_DUPLICATE
+            elif scraper.is_near_duplicate(url, parsed):
+                outcome = scraper.NEAR_DUPLICATE
+            else:
+                self.queues["store"].put((url, parsed))
+        self.queues["frontier"].put((url, (parsed.links, outcome)))
+
+    def _store(self, url, parsed):
+        scraper.store_page(url, parsed)
+
+    def _frontier(self, url, result):
+        # result is (links, outcome), or None when an earlier stage failed.
+        links, outcome = result or (None, scraper.ERROR)
+        try:
+            if links:
+                self.frontier.add_urls(links, url)
+        finally:
+            self.frontier.mark_url_complete(url, outcome)
+
+    def _report(self):
+        while not self.stopped.wait(self.REPORT_INTERVAL):
+            depths = ", ".join(
+                f"{stage} {depth}" for stage, depth in self.queue_depths().items())
+            self.logger.info(f"Queue depths: {depths}")
@@ -0,0 +1,269 @@
+import os
+import time
+import shelve
+import sqlite3
+
+from utils.metrics import metrics
+
+# The shelve store keeps the urls that are not downloaded yet in a second
+# shelve, so a resume reads only those. BUILT_KEY marks it as complete.
+PENDING_SUFFIX = ".pending"
+BUILT_KEY = "built"
+
+class ShelveStore(object):
+    ''' Stores (url, completed) pairs in a shelve keyed on the url hash,
+    and (url, depth, priority) of the urls still to be downloaded in a
+    second shelve next to it.
+    Writes go straight to the dbm files, but the files are only synced once
+    per commit interval instead of after every url. '''
+    def __init__(self, path, commit_interval):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.save = shelve.open(path)
+        self.pending = shelve.open(path + PENDING_SUFFIX)
+        if BUILT_KEY not in self.pending:
+            # Save file written before the pending shelve existed.
+            self._build_pending()
+        self.dirty = False
+        self.last_commit = time.time()
+
+    @staticmethod
+    def remove(path):
+        for name in (path, path + PENDING_SUFFIX):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def __contains__(self, urlhash):
+        return urlhash in self.save
+
+    def __len__(self):
+        return len(self.save)
+
+    def values(self):
+        return self.save.values()
+
+    def pending_batches(self, size):
+        ''' Yields (url, depth, priority) of the urls that are not downloaded
+        yet in lists of at most size. Each batch is read when it is asked
+        for, so the caller may hold its lock around every next() instead of
+        the whole loop. '''
+        hashes = [urlhash for urlhash in self.pending.keys() if urlhash != BUILT_KEY]
+        for i in range(0, len(hashes), size):
+            batch = list()
+            for urlhash in hashes[i:i + size]:
+                entry = self.pending.get(urlhash)
+                if isinstance(entry, str):
+                    # Written before urls had a priority.
+                    entry = (entry, 0, 0.0)
+                if entry is not None:
+                    batch.append(entry)
+            yield batch
+
+    def hash_batches(self, size):
+        ''' Yields the hash of every stored url in lists of at most size. '''
+        hashes = list(self.save.keys())
+        for i in range(0, len(hashes), size):
+            yield hashes[i:i + size]
+
+    def add_urls(self, entries):
+        ''' Adds (urlhash, url, depth, priority) entries that are not stored
+        yet and returns the urls that were added. '''
+        added = list()
+        for urlhash, url, depth, priority in entries:
+            if urlhash not in self.save:
+                self.save[urlhash] = (url, False)
+                self.pending[urlhash] = (url, depth, priority)
+                added.append(url)
+        if added:
+            self._written()
+        return added
+
+    def set_priority(self, urlhash, priority):
+        ''' Changes the priority of a url that is not downloaded yet. '''
+        entry = self.pending.get(urlhash)
+        if entry is not None and not isinstance(entry, str):
+            self.pending[urlhash] = (entry[0], entry[1], priority)
+            self._written()
+
+    def mark_complete(self, urlhash, url):
+        ''' Marks the url as downloaded. Returns False if it was never added. '''
+        known = urlhash in self.save
+        self.save[urlhash] = (url, True)
+        self.pending.pop(urlhash, None)
+        self._written()
+        return known
+
+    def commit(self):
+        if self.dirty:
+            with metrics.timer("frontier_commit"):
+                # Pending first: after a crash in between, a url is queued
+                # again rather than lost.
+                self.pending.sync()
+                self.save.sync()
+            self.dirty = False
+        self.last_commit = time.time()
+
+    def close(self):
+        self.commit()
+        self.pending.close()
+        self.save.close()
+
+    def _build_pending(self):
+        for urlhash, (url, completed) in self.save.items():
+            if not completed:
+                self.pending[urlhash] = (url, 0, 0.0)
+        self.pending[BUILT_KEY] = True
+        self.pending.sync()
+
+    def _written(self):
+        self.dirty = True
+        if time.time() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+
+class SQLiteStore(object):
+    ''' Stores urls in a SQLite database in WAL mode. Writes are grouped in
+    one transaction per commit interval, so a crash loses at most that many
+    seconds of discovered urls. '''
+    BATCH = 500
+
+    def __init__(self, path, commit_interval):
+        self.path = path
+        self.commit_interval = commit_interval
+        # The frontier serializes access with its own lock.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "hash TEXT PRIMARY KEY, url TEXT NOT NULL, "
+            "completed INTEGER NOT NULL, depth INTEGER NOT NULL DEFAULT 0, "
+            "priority REAL NOT NULL DEFAULT 0) WITHOUT ROWID")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(urls)")}
+        for column, definition in (
+                ("depth", "INTEGER NOT NULL DEFAULT 0"),
+                ("priority", "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:
+                # Save file written before urls had a priority.
+                self.db.execute(f"ALTER TABLE urls ADD COLUMN {column} {definition}")
+        # Only holds the urls not downloaded yet, so a resume reads those
+        # without scanning the whole table.
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS pending ON urls (hash) WHERE completed = 0")
+        self.db.commit()
+        self.dirty = False
+        self.last_commit = time.time()
+
+    @staticmethod
+    def remove(path):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def __contains__(self, urlhash):
+        return self.db.execute(
+            "SELECT 1 FROM urls WHERE hash = ?", (urlhash,)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def values(self):
+        for url, completed in self.db.execute("SELECT url, completed FROM urls"):
+            yield url, bool(completed)
+
+    def pending_batches(self, size):
+        ''' Yields (url, depth, priority) of the urls that are not downloaded
+        yet in lists of at most size. Each batch is its own query, so the
+        caller may hold its lock around every next() instead of the whole
+        loop. '''
+        last = ""
+        while True:
+            rows = self.db.execute(
+                "SELECT hash, url, depth, priority FROM urls "
+                "WHERE completed = 0 AND hash > ? ORDER BY hash LIMIT ?",
+                (last, size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [row[1:] for row in rows]
+
+    def hash_batches(self, size):
+        ''' Yields the hash of every stored url in lists of at most size.
+        Each batch is its own query, like pending_batches. '''
+        last = ""
+        while True:
+            hashes = [urlhash for (urlhash,) in self.db.execute(
+                "SELECT hash FROM urls WHERE hash > ? ORDER BY hash LIMIT ?",
+                (last, size))]
+            if not hashes:
+                return
+            last = hashes[-1]
+            yield hashes
+
+    def add_urls(self, entries):
+        ''' Adds (urlhash, url, depth, priority) entries that are not stored
+        yet and returns the urls that were added. '''
+        entries = {entry[0]: entry for entry in entries}
+        hashes = list(entries)
+        for i in range(0, len(hashes), self.BATCH):
+            batch = hashes[i:i + self.BATCH]
+            placeholders = ",".join("?" * len(batch))
+            for (urlhash,) in self.db.execute(
+                    f"SELECT hash FROM urls WHERE hash IN ({placeholders})", batch):
+                del entries[urlhash]
+        if entries:
+            self.db.executemany(
+                "INSERT INTO urls (hash, url, completed, depth, priority) "
+                "VALUES (?, ?, 0, ?, ?)", entries.values())
+            self._written()
+        return [entry[1] for entry in entries.values()]
+
+    def set_priority(self, urlhash, priority):
+        ''' Changes the priority of a url that is not downloaded yet. '''
+        self.db.execute(
+            "UPDATE urls SET priority = ? WHERE hash = ? AND completed = 0",
+            (priority, urlhash))
+        self._written()
+
+    def mark_complete(self, urlhash, url):
+        ''' Marks the url as downloaded. Returns False if it was never added. '''
+        cursor = self.db.execute(
+            "UPDATE urls SET completed = 1 WHERE hash = ?", (urlhash,))
+        known = cursor.rowcount > 0
+        if not known:
+            self.db.execute(
+                "INSERT INTO urls (hash, url, completed) VALUES (?, ?, 1)",
+                (urlhash, url))
+        self._written()
+        return known
+
+    def commit(self):
+        if self.dirty:
+            with metrics.timer("frontier_commit"):
+                self.db.commit()
+            self.dirty = False
+        self.last_commit = time.time()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def _written(self):
+        self.dirty = True
+        if time.time() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+
+STORES = {
+    "shelve": ShelveStore,
+    "sqlite": SQLiteStore,
+}
+
+
+def get_store_class(config):
+    try:
+        return STORES[config.store]
+    except KeyError:
+        raise ValueError(
+            f"Unknown frontier store {config.store!r}, "
+            f"expected one of {sorted(STORES)}.")
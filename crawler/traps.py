@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import time
+
+from urllib.parse import urlsplit
+
+from utils import get_logger
+from utils.metrics import metrics
+
+# Outcomes of a fetch (see scraper.py) that yield no page worth keeping.
+LOW_YIELD = frozenset([
+    "error", "not_html", "low_information", "exact_duplicate", "near_duplicate"])
+TRAPS_SUFFIX = ".traps"
+DIGITS = re.compile(r"\d+")
+# Segments that are ids rather than names: long hex strings and the like.
+ID_SEGMENT = re.compile(r"[0-9a-f]{8,}|[0-9a-z_-]{24,}", re.IGNORECASE)
+
+
+def url_template(url):
+    ''' (host, template) of a url. The template is the path with every run
+    of digits replaced by # and id-like segments by *, and the sorted names
+    of the query parameters, so /events/day/2024-01-05?page=2 and
+    /events/day/2023-12-31?page=7 share /events/day/#-#-#?page. '''
+    parsed = urlsplit(url)
+    segments = list()
+    for segment in parsed.path.split("/"):
+        if ID_SEGMENT.fullmatch(segment):
+            segment = "*"
+        else:
+            segment = DIGITS.sub("#", segment)
+        segments.append(segment)
+    template = "/".join(segments)
+    if parsed.query:
+        names = sorted(set(
+            param.partition("=")[0] for param in parsed.query.split("&") if param))
+        template += "?" + "&".join(names)
+    return (parsed.hostname or ""), template
+
+
+class TrapDetector(object):
+    ''' Tracks the yield of every url template of every host and stops
+    crawling the ones that turn out to be traps. The yield is a moving
+    average over the outcomes of its fetches, 1 for a page that was kept
+    and 0 for an error, a non-HTML or low information page or an exact or
+    near duplicate. Once a template has had config.trap_min_fetches fetches and
+    its yield falls below config.trap_min_yield, it is blocked: its queued
+    urls are pruned and no more are fetched. Templates and hosts also stop
+    at config.pattern_budget and config.host_budget fetches when those are
+    set. The yield of every host is averaged the same way, the frontier
+    ranks the links found on a host by it. The frontier calls every method
+    with its lock held.
+
+    The state is written to <save file>.traps once per commit interval and
+    loaded again on resume. Blocking decisions go to Logs/TRAPS.log. '''
+    def __init__(self, config, restart):
+        self.logger = get_logger("TRAPS")
+        self.path = config.save_file + TRAPS_SUFFIX
+        self.min_fetches = config.trap_min_fetches
+        self.min_yield = config.trap_min_yield
+        self.pattern_budget = config.pattern_budget
+        self.host_budget = config.host_budget
+        self.commit_interval = config.commit_interval
+        # (host, template) -> [fetches, yield, blocked]
+        self.templates = dict()
+        # host -> [fetches, yield]
+        self.hosts = dict()
+        self.dirty = False
+        self.last_save = time.time()
+        if restart:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        elif os.path.exists(self.path):
+            self._load()
+
+    def blocked(self, url):
+        ''' True if url belongs to a blocked or exhausted template or host. '''
+        return self.template_yield(url) is None
+
+    def template_yield(self, url):
+        ''' Yield of the template of url so far, 1 for a new one, or None if
+        url is not to be fetched. '''
+        host, template = url_template(url)
+        stats = self.templates.get((host, template))
+        if stats is not None and (stats[2] or (
+                self.pattern_budget and stats[0] >= self.pattern_budget)):
+            return None
+        host_stats = self.hosts.get(host)
+        if self.host_budget and host_stats and host_stats[0] >= self.host_budget:
+            return None
+        return stats[1] if stats is not None else 1.0
+
+    def host_yield(self, host):
+        ''' Yield of all fetches from host so far, 1 for a new host. '''
+        stats = self.hosts.get(host)
+        return stats[1] if stats is not None else 1.0
+
+    def admit(self, url):
+        ''' Counts a fetch of url against its budgets, or returns False if
+        it is not to be fetched. '''
+        if self.blocked(url):
+            return False
+        host, template = url_template(url)
+        stats = self.templates.get((host, template))
+        if stats is None:
+            stats = self.templates[(host, template)] = [0, 1.0, False]
+        stats[0] += 1
+        host_stats = self.hosts.get(host)
+        if host_stats is None:
+            host_stats = self.hosts[host] = [0, 1.0]
+        host_stats[0] += 1
+        self._written()
+        return True
+
+    def record(self, url, outcome):
+        ''' Updates the yield of the template and host of a fetched url. '''
+        host, template = url_template(url)
+        value = 0.0 if outcome in LOW_YIELD else 1.0
+        host_stats = self.hosts.get(host)
+        if host_stats is not None:
+            host_stats[1] += (value - host_stats[1]) / self.min_fetches
+        stats = self.templates.get((host, template))
+        if stats is None or stats[2]:
+            return
+        stats[1] += (value - stats[1]) / self.min_fetches
+        if stats[0] >= self.min_fetches and stats[1] < self.min_yield:
+            stats[2] = True
+            metrics.incr("trap_templates")
+            self.logger.info(
+                f"Blocked {host}{template} after {stats[0]} fetches, "
+                f"yield {stats[1]:.2f}, last outcome {outcome}.")
+        self._written()
+
+    def save(self):
+        if not self.dirty:
+            return
+        state = {
+            "templates": [
+                [host, template] + stats
+                for (host, template), stats in self.templates.items()],
+            "hosts": self.hosts}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+        self.last_save = time.time()
+
+    def close(self):
+        self.save()
+
+    def _load(self):
+        with open(self.path) as f:
+            state = json.load(f)
+        for host, template, fetches, value, blocked in state["templates"]:
+            self.templates[(host, template)] = [fetches, value, blocked]
+        self.hosts = state["hosts"]
+        blocked = sum(1 for stats in self.templates.values() if stats[2])
+        self.logger.info(
+            f"Loaded {len(self.templates)} url templates from {self.path}, "
+            f"{blocked} blocked.")
+
+    def _written(self):
+        self.dirty = True
+        if time.time() - self.last_save >= self.commit_interval:
+            self.save()
@@ -4,14 +4,14 @@ from inspect import getsource
 from utils.download import download
 from utils import get_logger
 import scraper
-import time
 
 
 class Worker(Thread):
-    def __init__(self, worker_id, config, frontier):
+    def __init__(self, worker_id, config, frontier, parse_pool=None):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
         self.config = config
         self.frontier = frontier
+        self.parse_pool = parse_pool
         # basic check for requests in scraper
         assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
         assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
@@ -23,12 +23,21 @@ class Worker(Thread):
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            outcome = scraper.ERROR
+            try:
+                resp = download(tbd_url, self.config, self.logger)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                if self.parse_pool is not None:
+                    # The pool marks the url complete once it is parsed.
+                    self.parse_pool.submit(tbd_url, resp)
+                    continue
+                parsed = scraper.scrape_page(tbd_url, resp)
+                outcome = parsed.outcome
+                self.frontier.add_urls(parsed.links, tbd_url)
+            except Exception as e:
+                self.logger.error(f"Failed to crawl {tbd_url}: {e!r}")
+            # Politeness delay is applied per host by the frontier, so the
+            # worker moves straight on to the next ready host.
+            self.frontier.mark_url_complete(tbd_url, outcome)
@@ -0,0 +1,201 @@
+from collections import namedtuple
+from html.parser import HTMLParser
+from bs4.dammit import UnicodeDammit
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Everything scraper.py needs from a page, collected in one pass.
+# hrefs: href of every <a> tag, stripped and lowercased.
+# robots: content of the first <meta name="robots">, lowercased.
+# title: text of the first <title> tag, or None.
+# headings: text of every h1-h3 tag in document order.
+# text: every visible text node, stripped, like get_text(strip=True).
+Page = namedtuple("Page", ["hrefs", "robots", "title", "headings", "text"])
+
+# The text rules follow BeautifulSoup with html.parser, which the scraper
+# used before: strings inside these tags are not part of get_text, void
+# tags never hold content, and an end tag closes the most recent open tag
+# with its name along with everything opened after it.
+SKIP_TEXT_TAGS = frozenset(["script", "style", "template", "rt", "rp"])
+VOID_TAGS = frozenset([
+    "area", "base", "basefont", "bgsound", "br", "col", "command", "embed",
+    "frame", "hr", "image", "img", "input", "isindex", "keygen", "link",
+    "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr"])
+HEADING_TAGS = frozenset(["h1", "h2", "h3"])
+PRESERVE_WHITESPACE_TAGS = frozenset(["pre", "textarea"])
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# Only ASCII letters were lowercased when the scraper lowercased the raw
+# bytes of the page.
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+class PageBuilder(object):
+    ''' Parser target that builds a Page from start/end/data events. '''
+    def __init__(self):
+        self.hrefs = list()
+        self.robots = None
+        self.title = None
+        self.headings = list()
+        self.text = list()
+        # Open tags as [name, buffer] where buffer collects the text of a
+        # title or heading tag, and the buffers that are currently open.
+        self._stack = list()
+        self._buffers = list()
+        self._skip = 0
+        self._preserve = 0
+        self._data = list()
+
+    def start(self, tag, attrib):
+        self._flush()
+        if tag == "a":
+            href = attrib.get("href")
+            if href:
+                self.hrefs.append(href.strip().translate(_ASCII_LOWER))
+        elif tag == "meta" and self.robots is None:
+            if attrib.get("name", "").translate(_ASCII_LOWER) == "robots":
+                self.robots = (attrib.get("content") or "").lower()
+        if tag in VOID_TAGS:
+            return
+        buffer = None
+        if tag in HEADING_TAGS:
+            buffer = list()
+            self.headings.append(buffer)
+        elif tag == "title" and self.title is None:
+            buffer = self.title = list()
+        if buffer is not None:
+            self._buffers.append(buffer)
+        if tag in SKIP_TEXT_TAGS:
+            self._skip += 1
+        elif tag in PRESERVE_WHITESPACE_TAGS:
+            self._preserve += 1
+        self._stack.append((tag, buffer))
+
+    def end(self, tag):
+        self._flush()
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                break
+        else:
+            return
+        closed_buffers = 0
+        for name, buffer in self._stack[i:]:
+            if name in SKIP_TEXT_TAGS:
+                self._skip -= 1
+            elif name in PRESERVE_WHITESPACE_TAGS:
+                self._preserve -= 1
+            if buffer is not None:
+                closed_buffers += 1
+        del self._stack[i:]
+        # Buffers are opened in stack order, so the closed ones are last.
+        if closed_buffers:
+            del self._buffers[-closed_buffers:]
+
+    def data(self, data):
+        self._data.append(data)
+
+    def comment(self, text):
+        self._flush()
+
+    def pi(self, target, data=None):
+        self._flush()
+
+    def cdata(self, data):
+        self._flush()
+        self._data.append(data)
+        self._flush()
+
+    def close(self):
+        self._flush()
+        return Page(
+            self.hrefs,
+            self.robots or "",
+            "".join(self.title) if self.title is not None else None,
+            ["".join(heading) for heading in self.headings],
+            self.text)
+
+    def _flush(self):
+        # Adjacent data events belong to one text node.
+        if not self._data or self._skip:
+            self._data.clear()
+            return
+        data = "".join(self._data)
+        self._data.clear()
+        stripped = data.strip()
+        if stripped:
+            self.text.append(stripped)
+        elif not self._preserve and not data.strip(ASCII_SPACES):
+            # BeautifulSoup collapses runs of whitespace between tags.
+            data = "\n" if "\n" in data else " "
+        for buffer in self._buffers:
+            buffer.append(data)
+
+
+class _HTMLParserEvents(HTMLParser):
+    ''' Feeds html.parser events to a PageBuilder. '''
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+        # Like BeautifulSoup, an end tag that matches an earlier void start
+        # tag is swallowed without ending the current text node.
+        self.already_closed = list()
+
+    def handle_starttag(self, tag, attrs, void_closes=True):
+        self.target.start(tag, {name: value or "" for name, value in attrs})
+        if void_closes and tag in VOID_TAGS:
+            self.already_closed.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, void_closes=False)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.already_closed:
+            self.already_closed.remove(tag)
+        else:
+            self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+    def handle_comment(self, data):
+        self.target.comment(data)
+
+    def handle_decl(self, decl):
+        self.target.comment(decl)
+
+    def handle_pi(self, data):
+        self.target.pi(data)
+
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self.target.cdata(data[len("CDATA["):])
+        else:
+            self.target.comment(data)
+
+
+def decode(content):
+    ''' Decodes page bytes the same way BeautifulSoup does. '''
+    return UnicodeDammit(content, is_html=True).unicode_markup or ""
+
+
+def extract_page(content, parser="html.parser"):
+    ''' Parses the page once and returns a Page.
+
+    "html.parser" reproduces what BeautifulSoup with html.parser extracted.
+    "lxml" uses lxml's C parser and is several times faster, but libxml2
+    repairs malformed markup differently, so text and links of broken pages
+    can differ. It falls back to html.parser when lxml is not installed. '''
+    markup = decode(content)
+    builder = PageBuilder()
+    if parser == "lxml" and etree is not None:
+        lxml_parser = etree.HTMLParser(target=builder)
+        lxml_parser.feed(markup)
+        return lxml_parser.close()
+    events = _HTMLParserEvents(builder)
+    events.feed(markup)
+    events.close()
+    return builder.close()
@@ -1,23 +1,46 @@
-from configparser import ConfigParser
-from argparse import ArgumentParser
-
-from utils.server_registration import get_cache_server
-from utils.config import Config
-from crawler import Crawler
-
-
-def main(config_file, restart):
-    cparser = ConfigParser()
-    cparser.read(config_file)
-    config = Config(cparser)
-    config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
-    crawler.start()
-
-
-if __name__ == "__main__":
-    parser = ArgumentParser()
-    parser.add_argument("--restart", action="store_true", default=False)
-    parser.add_argument("--config_file", type=str, default="config.ini")
-    args = parser.parse_args()
-    main(args.config_file, args.restart)
+from configparser import ConfigParser
+from argparse import ArgumentParser
+
+from utils.server_registration import get_cache_server
+from utils.config import Config
+from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.cluster import PartitionedFrontier, enter_node, run_nodes, merge
+
+
+def main(config_file, restart, node=None, merge_only=False, replay=False):
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    if replay:
+        assert config.response_cache, "Set RESPONSECACHE in config.ini to replay a crawl"
+        config.replay = True
+    if merge_only:
+        merge(config)
+        return
+    if config.nodes > 1 and node is None:
+        # Coordinator of a partitioned crawl.
+        run_nodes(config_file, config, restart)
+        return
+    frontier_factory = Frontier
+    if node is not None:
+        enter_node(config, node)
+        frontier_factory = PartitionedFrontier
+    if not config.replay:
+        config.cache_server = get_cache_server(config, restart)
+    crawler = Crawler(config, restart, frontier_factory=frontier_factory)
+    crawler.start()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--restart", action="store_true", default=False)
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--node", type=int, default=None,
+        help="run only this node of a partitioned crawl (see NODES)")
+    parser.add_argument("--merge", action="store_true", default=False,
+        help="only merge the page stores and metrics of the nodes")
+    parser.add_argument("--replay", action="store_true", default=False,
+        help="crawl from the response cache only, without politeness")
+    args = parser.parse_args()
+    main(args.config_file, args.restart, args.node, args.merge, args.replay)
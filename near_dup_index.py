@@ -0,0 +1,137 @@
+import os
+import numpy as np
+
+# Number of set bits in every byte value, for numpy versions without
+# np.bitwise_count.
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount(values):
+  if hasattr(np, 'bitwise_count'):
+    return np.bitwise_count(values)
+  return _POPCOUNT8[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+class FingerprintIndex:
+  '''
+  Near-duplicate index over 64-bit simhash fingerprints stored in a numpy
+  uint64 array. The fingerprint is cut into k + 1 bit blocks the same way
+  simhash.SimhashIndex does, so two fingerprints within Hamming distance k
+  share at least one block value. Every block has a table that lists the
+  document ids sorted by block value, with an offsets array indexed by the
+  block value (CSR layout), so a lookup is a slice per table. New documents
+  go to an unindexed tail that is scanned directly and merged into the
+  tables once it grows past a fraction of the index.
+  '''
+  def __init__(self, k=5, f=64):
+    self.k = k
+    self.f = f
+    step = f // (k + 1)
+    self._offsets = [step * i for i in range(k + 1)]
+    self._widths = [step] * k + [f - step * k]
+    self.urls = []
+    self._fps = np.empty(1024, dtype=np.uint64)
+    self._size = 0
+    # Documents [0, _indexed) are in the block tables.
+    self._indexed = 0
+    self._tables = [self._empty_table(width) for width in self._widths]
+
+  def __len__(self):
+    return self._size
+
+  @property
+  def fingerprints(self):
+    return self._fps[:self._size]
+
+  def add(self, url, fingerprint):
+    self.add_many([url], [fingerprint])
+
+  def add_many(self, urls, fingerprints):
+    fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+    if not len(fingerprints):
+      # A loaded index is read-only until something is added.
+      return
+    end = self._size + len(fingerprints)
+    if end > len(self._fps):
+      grown = np.empty(max(end, 2 * len(self._fps)), dtype=np.uint64)
+      grown[:self._size] = self._fps[:self._size]
+      self._fps = grown
+    self._fps[self._size:end] = fingerprints
+    self._size = end
+    self.urls.extend(urls)
+    if self._size - self._indexed > max(4096, self._indexed // 8):
+      self._build_tables()
+
+  def get_matches(self, fingerprint):
+    return self.get_matches_many([fingerprint])[0]
+
+  def get_matches_many(self, fingerprints):
+    ''' Returns, for every fingerprint, the urls of the documents within
+    Hamming distance k of it. '''
+    fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+    tail = self._fps[self._indexed:self._size]
+    results = []
+    for fingerprint in fingerprints:
+      candidates = [
+        ids[starts[key]:starts[key + 1]]
+        for (starts, ids), key in zip(self._tables, self._block_values(fingerprint))]
+      candidates = np.unique(np.concatenate(candidates))
+      close = candidates[popcount(self._fps[candidates] ^ fingerprint) <= self.k]
+      close_tail = np.flatnonzero(popcount(tail ^ fingerprint) <= self.k) + self._indexed
+      matches = dict.fromkeys(self.urls[i] for i in close)
+      matches.update(dict.fromkeys(self.urls[i] for i in close_tail))
+      results.append(list(matches))
+    return results
+
+  def freeze(self):
+    ''' Returns a read-only view of the indexed part that shares arrays with
+    this index, so it can be saved without holding up new additions. '''
+    frozen = FingerprintIndex(k=self.k, f=self.f)
+    frozen._fps = self._fps[:self._indexed]
+    frozen._size = frozen._indexed = self._indexed
+    frozen._tables = self._tables
+    return frozen
+
+  def save(self, path):
+    ''' Writes the indexed part of the index as .npy files under the path
+    directory. urls are not saved, they are kept by the caller. '''
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'fps.npy'), self._fps[:self._indexed])
+    for i, (starts, ids) in enumerate(self._tables):
+      np.save(os.path.join(path, f'starts{i}.npy'), starts)
+      np.save(os.path.join(path, f'ids{i}.npy'), ids)
+
+  @classmethod
+  def load(cls, path, urls, k=5, f=64, mmap=True):
+    ''' Loads tables written by save. With mmap the arrays stay on disk and
+    are shared through the page cache by every process that loads them,
+    until new documents are added and the index is copied into memory. '''
+    mode = 'r' if mmap else None
+    index = cls(k=k, f=f)
+    index._fps = np.load(os.path.join(path, 'fps.npy'), mmap_mode=mode)
+    index._size = index._indexed = len(index._fps)
+    index._tables = [
+      (np.load(os.path.join(path, f'starts{i}.npy'), mmap_mode=mode),
+       np.load(os.path.join(path, f'ids{i}.npy'), mmap_mode=mode))
+      for i in range(k + 1)]
+    index.urls = list(urls[:index._size])
+    return index
+
+  def _block_values(self, fingerprint):
+    fingerprint = int(fingerprint)
+    return [
+      fingerprint >> offset & ((1 << width) - 1)
+      for offset, width in zip(self._offsets, self._widths)]
+
+  def _empty_table(self, width):
+    return np.zeros((1 << width) + 1, dtype=np.int64), np.empty(0, dtype=np.uint32)
+
+  def _build_tables(self):
+    fps = self._fps[:self._size]
+    tables = []
+    for offset, width in zip(self._offsets, self._widths):
+      keys = (fps >> np.uint64(offset)) & np.uint64((1 << width) - 1)
+      ids = np.argsort(keys, kind='stable').astype(np.uint32)
+      starts = np.zeros((1 << width) + 1, dtype=np.int64)
+      np.cumsum(np.bincount(keys.astype(np.int64), minlength=1 << width), out=starts[1:])
+      tables.append((starts, ids))
+    self._tables = tables
+    self._indexed = self._size
@@ -0,0 +1,356 @@
+import os
+import gzip
+import time
+import atexit
+import shutil
+import struct
+from threading import Thread, Lock, Event
+from queue import Queue, Empty
+from utils.metrics import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# A segment file is a sequence of blocks. Every block is a header followed
+# by the compressed concatenation of its records, and every record is a
+# header, the url and the payload:
+#   block:  magic, codec, compressed size, raw size
+#   record: sha256 of the url (get_urlhash), url size, payload size
+BLOCK_HEADER = struct.Struct('<4sBII')
+RECORD_HEADER = struct.Struct('<32sII')
+# index entry: url hash, kind, segment number, offset of the block
+INDEX_ENTRY = struct.Struct('<32sBIQ')
+MAGIC = b'PGB1'
+GZIP, ZSTD = 0, 1
+KINDS = ('tokens', 'webpages')
+
+
+def compress(codec, data):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def decompress(codec, data):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read this page store")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class PageStore:
+    '''
+    Append-only store for the tokens and webpages of crawled pages, in place
+    of one loose file per page. Every kind has its own numbered segment
+    files under path, and index.bin maps url hash and kind to the segment and
+    offset of the block holding the record. put() only queues the record: a
+    background thread packs records into compressed blocks of about
+    block_size bytes and writes them, at the latest flush_interval seconds
+    after they were queued. Every time the store is opened a new segment is
+    started, so a block torn by a crash can only be at the end of an old
+    segment, where readers stop.
+    '''
+    def __init__(self, path='pages', block_size=1 << 20, segment_size=1 << 28, flush_interval=5.0, max_pending=1024):
+        self.path = path
+        self.block_size = block_size
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+        self.codec = ZSTD if zstandard is not None else GZIP
+        # put() blocks while max_pending records wait for the writer.
+        self._queue = Queue(max_pending)
+        self._index = None
+        self._index_lock = Lock()
+        self._closed = Event()
+        self._writer = None
+        self._writer_lock = Lock()
+        self._index_position = 0
+
+    @staticmethod
+    def remove(path='pages'):
+        shutil.rmtree(path, ignore_errors=True)
+
+    def put(self, kind, urlhash, url, payload):
+        ''' Queues a record. urlhash is the hex digest from get_urlhash and
+        payload is bytes. '''
+        if not isinstance(payload, (bytes, bytearray)):
+            raise TypeError(f"payload must be bytes, not {type(payload).__name__}")
+        self._start_writer()
+        self._queue.put((KINDS.index(kind), bytes.fromhex(urlhash), url.encode('utf-8'), payload))
+
+    def get(self, kind, urlhash):
+        ''' Returns (url, payload) of a stored record, or None. Only sees
+        records that were already written. '''
+        digest = bytes.fromhex(urlhash)
+        location = self._load_index().get((KINDS.index(kind), digest))
+        if location is None:
+            return None
+        segment, offset = location
+        for block_offset, records in self._read_blocks(self.segment_path(kind, segment), offset):
+            for record_digest, url, payload in records:
+                if record_digest == digest:
+                    return url, payload
+            break
+        return None
+
+    def segments(self, kind):
+        ''' Paths of the segments of one kind, oldest first. '''
+        return [self.segment_path(kind, number) for number in self._segment_numbers(kind)]
+
+    def segment_path(self, kind, number):
+        return os.path.join(self.path, f'{kind}-{number:05d}.seg')
+
+    def block_ranges(self, segment_path, start=0):
+        ''' (start, end) byte ranges of the complete blocks of a segment from
+        offset start on, read from the block headers only. '''
+        ranges = []
+        try:
+            size = os.path.getsize(segment_path)
+            with open(segment_path, 'rb') as f:
+                offset = start
+                f.seek(offset)
+                while True:
+                    header = f.read(BLOCK_HEADER.size)
+                    if len(header) < BLOCK_HEADER.size or header[:4] != MAGIC:
+                        break
+                    end = offset + BLOCK_HEADER.size + BLOCK_HEADER.unpack(header)[2]
+                    if end > size:
+                        break
+                    ranges.append((offset, end))
+                    offset = end
+                    f.seek(offset)
+        except OSError:
+            pass
+        return ranges
+
+    def iter_records(self, kind, start=0, end=None, segments=None, latest=False):
+        ''' Streams (urlhash, url, payload) for every record of a kind, one
+        block in memory at a time. start and end limit the byte range read
+        from each segment, which lets offline jobs shard a segment on block
+        ranges. With latest, only the record the index points at is yielded
+        for every url hash, so a page that was stored again, such as after a
+        crash before its download was committed, is seen once. '''
+        kind_id = KINDS.index(kind)
+        index = self._load_index() if latest else None
+        for segment_path in (segments if segments is not None else self.segments(kind)):
+            number = self._segment_number(kind, segment_path)
+            for offset, records in self._read_blocks(segment_path, start, end):
+                for digest, url, payload in records:
+                    if latest and index.get((kind_id, digest)) != (number, offset):
+                        continue
+                    yield digest.hex(), url, payload
+
+    def append_store(self, other):
+        ''' Copies the complete blocks of every segment of the store other
+        into new segments of this one and indexes their records, without
+        recompressing them. Merges the stores of the nodes of a partitioned
+        crawl (see crawler/cluster.py); nothing may be put meanwhile. '''
+        os.makedirs(self.path, exist_ok=True)
+        with self._open_index() as index:
+            for kind_id, kind in enumerate(KINDS):
+                numbers = self._segment_numbers(kind)
+                number = numbers[-1] + 1 if numbers else 0
+                for segment_path in other.segments(kind):
+                    ranges = other.block_ranges(segment_path)
+                    if not ranges:
+                        continue
+                    end = ranges[-1][1]
+                    with open(segment_path, 'rb') as src, open(self.segment_path(kind, number), 'wb') as dst:
+                        remaining = end
+                        while remaining:
+                            chunk = src.read(min(remaining, 1 << 20))
+                            dst.write(chunk)
+                            remaining -= len(chunk)
+                    entries = []
+                    for offset, records in other._read_blocks(segment_path, 0, end):
+                        entries.extend(
+                            INDEX_ENTRY.pack(digest, kind_id, number, offset)
+                            for digest, _, _ in records)
+                    index.write(b''.join(entries))
+                    number += 1
+        with self._index_lock:
+            self._index = None
+
+    def flush(self):
+        ''' Waits until every record queued so far is written. '''
+        if self._writer is not None and not self._closed.is_set():
+            done = Event()
+            self._queue.put(done)
+            done.wait()
+
+    def close(self):
+        if self._writer is not None and not self._closed.is_set():
+            self._closed.set()
+            self._queue.put(None)
+            self._writer.join()
+
+    def _start_writer(self):
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    os.makedirs(self.path, exist_ok=True)
+                    self._writer = Thread(target=self._write_loop, daemon=True)
+                    self._writer.start()
+                    atexit.register(self.close)
+
+    def _write_loop(self):
+        # Queue items are records, Events to set once everything before them
+        # is written, and None to stop.
+        streams = [_SegmentWriter(self, kind) for kind in KINDS]
+        index = self._open_index()
+        last_flush = time.time()
+        try:
+            while True:
+                try:
+                    item = self._queue.get(
+                        timeout=max(0, last_flush + self.flush_interval - time.time()))
+                except Empty:
+                    item = False
+                if item is None:
+                    break
+                if isinstance(item, tuple):
+                    kind, digest, url, payload = item
+                    if streams[kind].add(digest, url, payload) >= self.block_size:
+                        streams[kind].write_block(index)
+                    if time.time() - last_flush < self.flush_interval:
+                        continue
+                for stream in streams:
+                    stream.write_block(index)
+                last_flush = time.time()
+                if isinstance(item, Event):
+                    item.set()
+        finally:
+            for stream in streams:
+                stream.write_block(index)
+                stream.close()
+            index.close()
+
+    def _open_index(self):
+        # A crash can leave a torn entry at the end of index.bin, which is
+        # cut off, or every entry appended after it would be misaligned.
+        path = os.path.join(self.path, 'index.bin')
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        if size % INDEX_ENTRY.size:
+            os.truncate(path, size - size % INDEX_ENTRY.size)
+        return open(path, 'ab')
+
+    def _segment_numbers(self, kind):
+        numbers = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return numbers
+        for name in names:
+            if name.startswith(kind + '-') and name.endswith('.seg'):
+                numbers.append(self._segment_number(kind, name))
+        return sorted(numbers)
+
+    def _segment_number(self, kind, segment_path):
+        return int(os.path.basename(segment_path)[len(kind) + 1:-len('.seg')])
+
+    def _load_index(self):
+        # Reads the entries appended since the last call.
+        with self._index_lock:
+            if self._index is None:
+                self._index = dict()
+                self._index_position = 0
+            try:
+                with open(os.path.join(self.path, 'index.bin'), 'rb') as f:
+                    f.seek(self._index_position)
+                    data = f.read()
+            except OSError:
+                data = b''
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for digest, kind, segment, offset in INDEX_ENTRY.iter_unpack(data[:usable]):
+                self._index[(kind, digest)] = (segment, offset)
+            self._index_position += usable
+            return self._index
+
+    def _read_blocks(self, segment_path, start=0, end=None):
+        try:
+            f = open(segment_path, 'rb')
+        except OSError:
+            return
+        with f:
+            f.seek(start)
+            offset = start
+            while end is None or offset < end:
+                header = f.read(BLOCK_HEADER.size)
+                if len(header) < BLOCK_HEADER.size:
+                    return
+                magic, codec, compressed_size, raw_size = BLOCK_HEADER.unpack(header)
+                compressed = f.read(compressed_size)
+                if magic != MAGIC or len(compressed) < compressed_size:
+                    return
+                try:
+                    data = decompress(codec, compressed)
+                except (OSError, EOFError, ValueError):
+                    return
+                yield offset, list(_parse_records(data))
+                offset += BLOCK_HEADER.size + compressed_size
+
+
+class _SegmentWriter:
+    ''' Packs the records of one kind into blocks and appends them to the
+    current segment. Only used by the writer thread. '''
+    def __init__(self, store, kind):
+        self.store = store
+        self.kind = kind
+        self.kind_id = KINDS.index(kind)
+        numbers = store._segment_numbers(kind)
+        self.number = numbers[-1] + 1 if numbers else 0
+        self.file = None
+        self.buffer = bytearray()
+        self.digests = []
+
+    def add(self, digest, url, payload):
+        self.buffer += RECORD_HEADER.pack(digest, len(url), len(payload))
+        self.buffer += url
+        self.buffer += payload
+        self.digests.append(digest)
+        return len(self.buffer)
+
+    def write_block(self, index):
+        if not self.buffer:
+            return
+        if self.file is not None and self.file.tell() >= self.store.segment_size:
+            self.file.close()
+            self.file = None
+            self.number += 1
+        if self.file is None:
+            self.file = open(self.store.segment_path(self.kind, self.number), 'ab')
+        offset = self.file.tell()
+        with metrics.timer('page_store_compress'):
+            compressed = compress(self.store.codec, bytes(self.buffer))
+        with metrics.timer('page_store_write'):
+            self.file.write(BLOCK_HEADER.pack(MAGIC, self.store.codec, len(compressed), len(self.buffer)))
+            self.file.write(compressed)
+            self.file.flush()
+        # The index only points at blocks that are fully written.
+        index.write(b''.join(
+            INDEX_ENTRY.pack(digest, self.kind_id, self.number, offset)
+            for digest in self.digests))
+        index.flush()
+        self.buffer = bytearray()
+        self.digests = []
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def _parse_records(data):
+    view = memoryview(data)
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        digest, url_size, payload_size = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        url = bytes(view[offset:offset + url_size]).decode('utf-8')
+        offset += url_size
+        payload = bytes(view[offset:offset + payload_size])
+        offset += payload_size
+        yield digest, url, payload
@@ -1,25 +1,145 @@
+import os
 import json
-from simhash import Simhash, SimhashIndex
+import shutil
+from array import array
+from threading import Lock
+from simhash import Simhash
+from near_dup_index import FingerprintIndex
+from utils.metrics import metrics
+from utils.append_log import AppendLog, append_file, read_records
 
 class PersistentSimhashIndex:
-  def __init__(self, filepath='simhash_index.json', k=5):
+  '''
+  Near-duplicate index whose fingerprints are kept in two append-only logs:
+  <filepath>.fp holds one 8-byte fingerprint per document and <filepath>.urls
+  the matching url on its own line. An AppendLog appends new documents every
+  flush_interval seconds. Every snapshot_every documents the block
+  tables of the FingerprintIndex are saved as .npy files, and startup maps
+  them from disk and only replays the log tail.
+  '''
+  def __init__(self, filepath='simhash_index', k=5, flush_interval=1.0, snapshot_every=50000):
     self._filepath = filepath
     self._k = k
-    try:
-      with open(self._filepath, 'r') as f:
-        self._data = json.load(f)
-    except:
-      self._data = {}
-    
-    self._index = SimhashIndex([(url, Simhash(int(hash_val))) for url, hash_val in self._data.items()], k=self._k)
+    self._snapshot_every = snapshot_every
+    self._lock = Lock()
+
+    urls, values = self._read_log()
+    self._migrate_json(urls, values)
+    self._index = self._load_snapshot(urls)
+    self._snapshot_count = len(self._index)
+    self._index.add_many(urls[self._snapshot_count:], values[self._snapshot_count:])
+
+    self._log = AppendLog(self._write, flush_interval)
+
+  @staticmethod
+  def remove(filepath='simhash_index'):
+    ''' Deletes the logs and snapshots of an index. '''
+    directory = os.path.dirname(filepath) or '.'
+    prefix = os.path.basename(filepath) + '.'
+    for name in os.listdir(directory):
+      if name.startswith(prefix):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+          shutil.rmtree(path)
+        else:
+          os.remove(path)
 
   def add_doc(self, url, tokens):
-    simhash = Simhash(tokens)
-    self._data[url] = simhash.value
-    self._index.add(url, simhash)
-    with open(self._filepath, "w") as f:
-      json.dump(self._data, f)
-  
+    self.add_fingerprint(url, Simhash(tokens).value)
+
+  def add_fingerprint(self, url, value):
+    with self._lock:
+      self._index.add(url, value)
+      self._log.add((url, value))
+
   def get_matches(self, tokens):
-    simhash = Simhash(tokens)
-    return self._index.get_near_dups(simhash)
+    return self.get_fingerprint_matches(Simhash(tokens).value)
+
+  def get_fingerprint_matches(self, value):
+    with self._lock:
+      return self._index.get_matches(value)
+
+  def close(self):
+    self._log.close()
+
+  def flush(self):
+    self._log.flush()
+
+  def _write(self, pending):
+    with metrics.timer('index_flush'):
+      self._write_log(pending)
+    self._write_snapshot()
+
+  def _write_log(self, pending):
+    # The url has to be on disk before its fingerprint, a fingerprint
+    # without a url is dropped on the next load.
+    append_file(
+      self._filepath + '.urls',
+      ''.join(url.replace('\n', ' ') + '\n' for url, _ in pending).encode('utf-8'))
+    append_file(
+      self._filepath + '.fp', array('Q', (value for _, value in pending)).tobytes())
+
+  def _write_snapshot(self):
+    with self._lock:
+      frozen = self._index.freeze()
+    count = len(frozen)
+    if count - self._snapshot_count < self._snapshot_every:
+      return
+    path = f'{self._filepath}.snap.{count}'
+    frozen.save(path)
+    # Point the manifest at the new tables before removing the old ones.
+    tmp = self._filepath + '.snap.tmp'
+    with open(tmp, 'w') as f:
+      f.write(f'{os.path.basename(path)}\n')
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp, self._filepath + '.snap')
+    old = f'{self._filepath}.snap.{self._snapshot_count}'
+    if self._snapshot_count and os.path.isdir(old):
+      shutil.rmtree(old)
+    self._snapshot_count = count
+
+  def _load_snapshot(self, urls):
+    try:
+      with open(self._filepath + '.snap', 'r') as f:
+        name = f.read().strip()
+      path = os.path.join(os.path.dirname(self._filepath), name)
+      index = FingerprintIndex.load(path, urls, k=self._k)
+    except (OSError, ValueError):
+      return FingerprintIndex(k=self._k)
+    if len(index) > len(urls):
+      # The snapshot is ahead of the logs, rebuild from the logs alone.
+      return FingerprintIndex(k=self._k)
+    return index
+
+  def _read_log(self):
+    values = array('Q')
+    values.frombytes(read_records(self._filepath + '.fp', values.itemsize))
+    try:
+      with open(self._filepath + '.urls', 'r', encoding='utf-8') as f:
+        urls = f.read().split('\n')[:-1]
+    except OSError:
+      urls = []
+    count = min(len(urls), len(values))
+    if count != len(urls) or count != len(values):
+      self._truncate(urls[:count], values[:count])
+    return urls[:count], values[:count]
+
+  def _truncate(self, urls, values):
+    with open(self._filepath + '.urls', 'w', encoding='utf-8') as f:
+      f.write(''.join(url + '\n' for url in urls))
+    with open(self._filepath + '.fp', 'wb') as f:
+      values.tofile(f)
+
+  def _migrate_json(self, urls, values):
+    # Import an index written by the old json format once.
+    if urls or not os.path.exists(self._filepath + '.json'):
+      return
+    try:
+      with open(self._filepath + '.json', 'r') as f:
+        data = json.load(f)
+    except ValueError:
+      return
+    urls.extend(data)
+    values.extend(int(value) for value in data.values())
+    self._truncate(urls, values)
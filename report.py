@@ -1,41 +1,168 @@
+import os
+import heapq
+import pickle
 from pathlib import Path
+from itertools import groupby
+from operator import itemgetter
+from argparse import ArgumentParser
+from collections import Counter
 from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
+from tokenizer import word_frequencies
+from page_store import PageStore
 # 1) Number of unique pages
 # 2) Longest page (# of words)
 # 3) 50 most common words (ignoring stop words)
 # 4) Number of subdomains in uci.edu, listed alphabetically and with number of pages in the subdomain
-def iteratePages():
-    max_words = 0
-    n_pages = 0
-    word_freqs = dict()
-    longest_page = ''
-    subdomains = dict()
-    for file in Path('./tokens').iterdir():  
-        n_pages += 1
-        with open(file) as f:
-            url = f.readline().rstrip('\n')
-            parsed = urlparse(url)
-            subdomain = parsed.netloc.lower()
-            subdomains[subdomain] = subdomains.get(subdomain,0)+1
-            tokens = f.readline().rstrip('\n').split(' ')
-            for token in tokens:
-                word_freqs[token] = word_freqs.get(token, 0) + 1
-            if len(tokens) > max_words:
-                max_words = len(tokens)
-                longest_page = url
-    sorted_freqs = sorted(word_freqs.items(), key=lambda item: item[1], reverse=True)
-    subdomains = sorted(subdomains.items(), key=lambda item: item[0])
-    return n_pages, max_words, longest_page, sorted_freqs[:50], subdomains
-
-n_pages, max_words, longest_page, top_50_words, subdomains = iteratePages()
-
-pages_crawled_str = f"1. Unique pages crawled: {n_pages}"
-longest_page_str = f"2. Longest page: {longest_page} ({max_words} words)"
-top_50_lines = '\n'.join([f'{word}: {freq}' for word, freq in top_50_words])
-top_50_words_str = f"3. Top 50 words:\n{top_50_lines}"
-subdomains_lines = '\n'.join([f'{subdomain}: {count}' for subdomain, count in subdomains])
-num_subdomains_str = f"4. Number of subdomains found: {len(subdomains)}\n{subdomains_lines}"
-
-report_questions = [pages_crawled_str,longest_page_str,top_50_words_str,num_subdomains_str]
-with open('report.txt', 'w') as report:
-    report.write('\n\n'.join(report_questions))
+
+class PageStats:
+    ''' Tallies of a set of pages. Stats of consecutive shards merge into
+    the same result as counting all of their pages in order. files holds the
+    token files and segments the offset up to which every page store
+    segment was counted, and hashes the url hashes of the pages counted
+    from the page store. '''
+    def __init__(self):
+        self.n_pages = 0
+        self.max_words = 0
+        self.longest_page = ''
+        self.word_freqs = Counter()
+        self.subdomains = Counter()
+        self.files = set()
+        self.segments = dict()
+        self.hashes = set()
+
+    def add_page(self, url, tokens):
+        self.n_pages += 1
+        self.subdomains[urlparse(url).netloc.lower()] += 1
+        word_frequencies(tokens, self.word_freqs)
+        if len(tokens) > self.max_words:
+            self.max_words = len(tokens)
+            self.longest_page = url
+
+    def merge(self, other):
+        self.n_pages += other.n_pages
+        self.word_freqs.update(other.word_freqs)
+        self.subdomains.update(other.subdomains)
+        self.files |= other.files
+        self.segments.update(other.segments)
+        self.hashes |= other.hashes
+        if other.max_words > self.max_words:
+            self.max_words = other.max_words
+            self.longest_page = other.longest_page
+
+def count_shard(shard):
+    stats = PageStats()
+    if shard[0] == 'files':
+        for path in shard[1]:
+            with open(path) as f:
+                url = f.readline().rstrip('\n')
+                tokens = f.readline().rstrip('\n').split(' ')
+            stats.add_page(url, tokens)
+            stats.files.add(os.path.basename(path))
+    else:
+        _, store_path, segment, start, end = shard
+        store = PageStore(store_path)
+        # Only the last record of a page that was stored more than once is
+        # counted, and none of a page an earlier run already counted.
+        for urlhash, url, payload in store.iter_records('tokens', start, end, segments=[segment], latest=True):
+            if urlhash in counted_hashes:
+                continue
+            stats.add_page(url, payload.decode('utf-8').split(' '))
+            stats.hashes.add(urlhash)
+        stats.segments[os.path.basename(segment)] = end
+    return stats
+
+# Url hashes counted by earlier runs, set in every process that counts
+# shards.
+counted_hashes = frozenset()
+
+def set_counted_hashes(hashes):
+    global counted_hashes
+    counted_hashes = frozenset(hashes)
+
+def file_shards(token_dir, stats, n_shards):
+    paths = [str(path) for path in Path(token_dir).iterdir() if path.name not in stats.files]
+    size = max(1, -(-len(paths) // n_shards))
+    return [('files', paths[i:i + size]) for i in range(0, len(paths), size)]
+
+def store_shards(store_path, stats, n_shards):
+    # Every shard is a run of blocks of one segment that was not counted yet.
+    store = PageStore(store_path)
+    blocks = []
+    for segment in store.segments('tokens'):
+        start = stats.segments.get(os.path.basename(segment), 0)
+        blocks.extend((segment, start, end) for start, end in store.block_ranges(segment, start))
+    size = max(1, -(-len(blocks) // n_shards))
+    shards = []
+    for i in range(0, len(blocks), size):
+        for segment, run in groupby(blocks[i:i + size], key=itemgetter(0)):
+            run = list(run)
+            shards.append(('blocks', store_path, segment, run[0][1], run[-1][2]))
+    return shards
+
+def load_checkpoint(checkpoint):
+    stats = PageStats()
+    try:
+        with open(checkpoint, 'rb') as f:
+            stats.__dict__.update(pickle.load(f))
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+    return stats
+
+def save_checkpoint(stats, checkpoint):
+    tmp = checkpoint + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(vars(stats), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, checkpoint)
+
+def iteratePages(store_path='pages', checkpoint='report_checkpoint.pkl', processes=None, token_dir=None):
+    ''' Counts the pages of the page store, or of a directory of token files,
+    that are not in the checkpoint yet, sharded over a process pool, and adds
+    them to the checkpointed stats. '''
+    stats = load_checkpoint(checkpoint) if checkpoint else PageStats()
+    processes = processes or os.cpu_count() or 1
+    if token_dir:
+        shards = file_shards(token_dir, stats, processes * 4)
+    else:
+        shards = store_shards(store_path, stats, processes * 4)
+    if shards:
+        # Shards are merged in order, so ties resolve like a serial pass.
+        if processes == 1 or len(shards) == 1:
+            set_counted_hashes(stats.hashes)
+            for shard in map(count_shard, shards):
+                stats.merge(shard)
+        else:
+            with ProcessPoolExecutor(processes, initializer=set_counted_hashes, initargs=(stats.hashes,)) as executor:
+                for shard in executor.map(count_shard, shards):
+                    stats.merge(shard)
+        if checkpoint:
+            save_checkpoint(stats, checkpoint)
+    top_50_words = heapq.nlargest(50, stats.word_freqs.items(), key=itemgetter(1))
+    subdomains = sorted(stats.subdomains.items(), key=lambda item: item[0])
+    return stats.n_pages, stats.max_words, stats.longest_page, top_50_words, subdomains
+
+def write_report(n_pages, max_words, longest_page, top_50_words, subdomains, filename='report.txt'):
+    pages_crawled_str = f"1. Unique pages crawled: {n_pages}"
+    longest_page_str = f"2. Longest page: {longest_page} ({max_words} words)"
+    top_50_lines = '\n'.join([f'{word}: {freq}' for word, freq in top_50_words])
+    top_50_words_str = f"3. Top 50 words:\n{top_50_lines}"
+    subdomains_lines = '\n'.join([f'{subdomain}: {count}' for subdomain, count in subdomains])
+    num_subdomains_str = f"4. Number of subdomains found: {len(subdomains)}\n{subdomains_lines}"
+
+    report_questions = [pages_crawled_str,longest_page_str,top_50_words_str,num_subdomains_str]
+    with open(filename, 'w') as report:
+        report.write('\n\n'.join(report_questions))
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--store", type=str, default="pages")
+    parser.add_argument("--token_dir", type=str, default=None,
+        help="count a directory of token files written by older crawls instead")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--checkpoint", type=str, default="report_checkpoint.pkl")
+    parser.add_argument("--rebuild", action="store_true", default=False,
+        help="ignore the checkpoint and count every file again")
+    args = parser.parse_args()
+    if args.rebuild and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    write_report(*iteratePages(args.store, args.checkpoint, args.processes, args.token_dir))
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+
+from threading import Lock
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import get_logger
+from utils.download import download
+from utils.metrics import metrics
+
+ROBOTS_SUFFIX = ".robots"
+
+
+class RobotsCache(object):
+    ''' robots.txt rules of every host of the crawl. A host's robots.txt is
+    fetched through utils.download by a small thread pool the first time
+    it is asked for, and again once it is config.robots_ttl seconds old;
+    until then the rules it had stay in use. The rules are kept compiled
+    in memory and the fetched files in <save file>.robots, which is kept
+    across restarts so a fresh crawl does not fetch them again.
+
+    Like urllib.robotparser, a 401 or 403 disallows the whole host and any
+    other failure allows it. on_ready(host, delay) is called from a pool
+    thread once the rules of a host arrive, with the seconds the host
+    asks for between downloads, if any. '''
+    def __init__(self, config, on_ready):
+        self.logger = get_logger("ROBOTS")
+        self.config = config
+        self.path = config.save_file + ROBOTS_SUFFIX
+        self.ttl = config.robots_ttl
+        self.on_ready = on_ready
+        self.lock = Lock()
+        # host -> RobotFileParser
+        self.rules = dict()
+        # host -> [fetched at, status, text]
+        self.files = dict()
+        self.fetching = set()
+        self.dirty = False
+        self.last_save = time.time()
+        self.pool = ThreadPoolExecutor(
+            max(1, config.threads_count), thread_name_prefix="robots")
+        if os.path.exists(self.path):
+            self._load()
+
+    def known(self, host):
+        ''' True if the rules of host are here, possibly old. '''
+        return host in self.rules
+
+    def allowed(self, url):
+        ''' False if the robots.txt of the url's host disallows it. A url of
+        a host whose rules are not here yet is allowed. '''
+        host = (urlsplit(url).hostname or "").lower()
+        rules = self.rules.get(host)
+        return rules is None or rules.can_fetch(self.config.user_agent, url)
+
+    def crawl_delay(self, host):
+        ''' Crawl-delay of host in seconds, or None. '''
+        rules = self.rules.get(host)
+        if rules is None:
+            return None
+        delay = rules.crawl_delay(self.config.user_agent)
+        return float(delay) if delay is not None else None
+
+    def request(self, url):
+        ''' Fetches the robots.txt of the url's host in the background
+        unless its rules are here and fresh. '''
+        parsed = urlsplit(url)
+        host = (parsed.hostname or "").lower()
+        with self.lock:
+            if host in self.fetching:
+                return
+            fetched = self.files.get(host)
+            if fetched is not None and time.time() - fetched[0] < self.ttl:
+                return
+            self.fetching.add(host)
+        self.pool.submit(self._fetch, host, f"{parsed.scheme}://{parsed.netloc}/robots.txt")
+
+    def commit(self):
+        ''' Saves the files fetched since the last save. The frontier calls
+        this every commit interval, as fetches alone only save once a later
+        one comes after it. '''
+        with self.lock:
+            self.save()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.commit()
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.files, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+        self.last_save = time.time()
+
+    def _fetch(self, host, robots_url):
+        status, text = 0, ""
+        try:
+            with metrics.timer("robots_fetch"):
+                resp = download(robots_url, self.config, self.logger)
+            status = resp.status
+            if status == 200 and resp.content:
+                text = resp.content.decode("utf-8", errors="replace")
+        except Exception as e:
+            self.logger.error(f"Failed to fetch {robots_url}: {e!r}")
+        rules = _compile(status, text)
+        metrics.incr("robots_fetches")
+        with self.lock:
+            self.rules[host] = rules
+            self.files[host] = [time.time(), status, text]
+            self.fetching.discard(host)
+            self.dirty = True
+            if time.time() - self.last_save >= self.config.commit_interval:
+                self.save()
+        try:
+            self.on_ready(host, self.crawl_delay(host))
+        except Exception as e:
+            self.logger.error(f"Failed to apply the robots.txt of {host}: {e!r}")
+
+    def _load(self):
+        with open(self.path) as f:
+            self.files = json.load(f)
+        for host, (_, status, text) in self.files.items():
+            self.rules[host] = _compile(status, text)
+        self.logger.info(
+            f"Loaded the robots.txt of {len(self.files)} hosts from {self.path}.")
+
+
+def _compile(status, text):
+    rules = RobotFileParser()
+    if status in (401, 403):
+        rules.disallow_all = True
+    elif status == 200:
+        rules.parse(text.splitlines())
+    else:
+        rules.allow_all = True
+    return rules
@@ -1,156 +1,250 @@
-import re
-from urllib.parse import urlparse, urldefrag, urljoin
-from bs4 import BeautifulSoup
-from utils import get_urlhash, get_logger
-import nltk
-from stopwords import stopwords
-from persistent_index import PersistentSimhashIndex
-
-error_logger = get_logger('errors')
-index = PersistentSimhashIndex()
-
-def scraper(url, resp):
-    links = extract_next_links(url, resp)
-    return [link for link in links if is_valid(link)]
-
-
-def extract_next_links(url: str, resp):
-    # Implementation required.
-    # url: the URL that was used to get the page
-    # resp.url: the actual url of the page
-    # resp.status: the status code returned by the server. 200 is OK, you got the page. Other numbers mean that there was some kind of problem.
-    # resp.error: when status is not 200, you can check the error here, if needed.
-    # resp.raw_response: this is where the page actually is. More specifically, the raw_response has two parts:
-    #         resp.raw_response.url: the url, again
-    #         resp.raw_response.content: the content of the page!
-    # Return a list with the hyperlinks (as strings) scraped from resp.raw_response.content
-    try:
-        if resp.status != 200:
-            error_logger.error('URL: '+url+' returned status code ' + str(resp.status))
-            if resp.error:
-                error_logger.error('Error: '+resp.error)
-            return list()
-        
-        # Only accept HTML
-        content = resp.raw_response.content.lower()
-        if (resp.headers and 'text/html' not in resp.headers['Content-Type']) or (b'<html' not in content and b'<!doctype html' not in content):
-            error_logger.info(f'URL {url} is not HTML')
-            return list()
-        
-        # Process HTML
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        robots_tag = soup.find("meta",attrs={'name':'robots'})
-        robots = robots_tag.get("content","").lower() if robots_tag else ""
-        links = list()
-        if 'nofollow' not in robots:
-            for link in soup.find_all('a'):
-                if link and link.get('href'):
-                    href = link.get('href',"").strip()
-                    if 'mailto:' in href or href.startswith('#'):
-                        continue
-                    new_url = urljoin(resp.raw_response.url, href)
-                    links.append(urldefrag(new_url).url)
-        if 'noindex' in robots:
-            return links
-        
-        text = soup.get_text(separator=" ",strip=True)
-        filename = get_urlhash(url)
-        tokens = tokenize(clean_text(text))
-        
-        if len(tokens) < 10:
-            error_logger.info('URL: '+url+' returned low information')
-            return links
-        
-        try:
-            similar_docs = getSimilarDocs(url, soup)
-            if len(similar_docs) > 0:
-                similar_docs_string = ', '.join(similar_docs)
-                error_logger.error(f'Site {url} is similar to {similar_docs_string}')
-                return links
-        except:
-            pass
-
-        with open("tokens/"+filename, 'w') as f:
-            f.write(url+"\n"+' '.join(tokens))
-        
-        with open("webpages/"+filename,'w') as f:
-            f.write(url+"\n"+str(content))
-            
-        return links
-    except Exception as e:
-        error_logger.error(repr(e))
-        return list()
-
-def tokenize(text):
-    return [token for token in nltk.word_tokenize(text) if token not in stopwords and len(token) > 2]
-
-def clean_text(text):
-    return re.sub(r"[^a-z\s]",'', text.lower())
-
-def getSimilarDocs(url, soup: BeautifulSoup):
-    tokens = []
-    if soup.title:
-        for word in tokenize(clean_text(soup.title.getText())):
-            tokens.append((word, 3))
-    for h in soup.find_all(['h1','h2','h3']):
-        for word in tokenize(clean_text(h.get_text())):
-            tokens.append((word, 2))
-    for word in tokenize(clean_text(soup.get_text(separator=" ",strip=True))):
-        tokens.append((word, 1))
-    similarDocs = index.get_matches(tokens)
-    index.add_doc(url, tokens)
-    return similarDocs
-
-def is_valid(url):
-    # Decide whether to crawl this url or not.
-    # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
-    try:
-        url = url.lower()
-        parsed = urlparse(url)
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        if re.match(
-            r".*\.(src|rpm|css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz|sql|txt|ppsx|img|ff)$", parsed.path):
-            return False
-        # calendar link, download, login, sharing to twitter or facebook
-        if re.match(r".*(ical|tribe_events?|tribe-bar-date|action=|share=(twitter|facebook)|do=).*", parsed.query):
-            return False
-        # french page
-        if '.fr' in parsed.path:
-            return False
-        if 'calendar' in url:
-            return False
-        # filter dates for calendars
-        if re.match(r"/(events|day|month).*/\d{4}-\d{2}(-\d{2})?.*", parsed.path):
-            return False
-        # file uploads and login form
-        if re.match(r".*/wp-(content|login).*", parsed.path):
-            return False
-        if 'gitlab' in parsed.hostname and ('commit' in parsed.path or 'tag' in parsed.path):
-            return False
-        # I used the regex from https://support.archive-it.org/hc/en-us/articles/208332963-Modify-crawl-scope-with-a-Regular-Expression which blocks URLS with repeated paths, but I modified it for my own needs to include repeated numbers in paths
-        # Repeated paths (excluding the specified URL which has content and is not a crawler trap)
-        if re.match(r"^.*?(/[a-zA-Z]+?/).*?\1.*$|^.*?/([a-zA-Z]+?/)\2.*$", url) and 'grape.ics.uci.edu/wiki/public/wiki' not in url:
-            return False
-        if not re.match(
-            r".*(ics|cs|informatics|stat|today)\.uci\.edu",
-            parsed.hostname,
-        ):
-            return False
-        if "today.uci.edu" in parsed.hostname and "department/information_computer_sciences" not in parsed.path:
-            return False
-
-        return True
-
-    except Exception as e:
-        print(repr(e))
-        return False
\ No newline at end of file
+import re
+from collections import namedtuple
+from urllib.parse import urldefrag, urljoin
+from utils import get_urlhash, get_logger, EventSummary
+from utils.metrics import metrics
+from extraction import extract_page
+from tokenizer import tokenize, clean_text, tokenize_many
+from url_filter import is_valid, filter_urls
+from url_canon import canonicalize
+from persistent_index import PersistentSimhashIndex
+from content_index import ContentHashIndex, content_hash
+from page_store import PageStore
+from simhash import Simhash
+from threading import Lock
+
+error_logger = get_logger('errors')
+# Pages that are dropped are counted per host and logged once a minute.
+dropped_pages = EventSummary(error_logger)
+# The index and the page store are opened on first use, so parser processes
+# that only import this module for parse_page do not open them.
+index = None
+page_store = None
+content_index = None
+_open_lock = Lock()
+# Workers share the index, so a lookup and the insert that follows it must
+# not interleave with another thread's.
+index_lock = Lock()
+# Case-insensitive search of the raw bytes, so the page is not copied.
+html_marker = re.compile(rb'<html|<!doctype html', re.IGNORECASE)
+# "lxml" parses faster but repairs broken markup differently, see extraction.py
+html_parser = "html.parser"
+
+# Result of parse_page. tokens, content and fingerprint are None when the
+# page is not to be stored. outcome is one of the outcomes below, which the
+# frontier's trap detector uses to judge the yield of the url's template.
+# text_hash is the content_hash of a page to store whose text was not yet
+# checked for an exact copy, see parse_page.
+ParsedPage = namedtuple(
+    "ParsedPage", ["links", "tokens", "content", "fingerprint", "outcome", "text_hash"],
+    defaults=(None,))
+OK = "ok"
+ERROR = "error"
+NOT_HTML = "not_html"
+NOINDEX = "noindex"
+LOW_INFORMATION = "low_information"
+EXACT_DUPLICATE = "exact_duplicate"
+NEAR_DUPLICATE = "near_duplicate"
+
+def scraper(url, resp):
+    return scrape_page(url, resp).links
+
+def scrape_page(url, resp):
+    # Like scraper, but returns the ParsedPage with the outcome of the page.
+    return record_page(url, parse_page(url, resp, get_content_index()))
+
+
+def parse_page(url: str, resp, content_index=None):
+    # url: the URL that was used to get the page
+    # resp.url: the actual url of the page
+    # resp.status: the status code returned by the server. 200 is OK, you got the page. Other numbers mean that there was some kind of problem.
+    # resp.error: when status is not 200, you can check the error here, if needed.
+    # resp.raw_response: this is where the page actually is. More specifically, the raw_response has two parts:
+    #         resp.raw_response.url: the url, again
+    #         resp.raw_response.content: the content of the page!
+    # Parses the page and returns a ParsedPage with the valid links scraped
+    # from resp.raw_response.content. Does not touch the shared index or
+    # page store, so it can run in a parser process (see crawler/parse_pool.py).
+    # With a content_index, exact copies of a page seen before are dropped
+    # here before they are tokenized. A parser process has none, so it
+    # returns the text_hash for record_page to check.
+    try:
+        if resp.status != 200:
+            dropped_pages.add(f'status {resp.status}', url,
+                f'{url} ({resp.error})' if resp.error else url)
+            return ParsedPage(list(), None, None, None, ERROR)
+        
+        # Only accept HTML. The headers are checked first, so the body of
+        # a page they reject is never unpickled.
+        if resp.headers and 'text/html' not in resp.headers['Content-Type']:
+            dropped_pages.add(NOT_HTML, url)
+            return ParsedPage(list(), None, None, None, NOT_HTML)
+        content = resp.content
+        if content is None or not html_marker.search(content):
+            dropped_pages.add(NOT_HTML, url)
+            return ParsedPage(list(), None, None, None, NOT_HTML)
+        
+        # Process HTML in a single pass
+        with metrics.timer('parse'):
+            page = extract_page(content, html_parser)
+        
+        robots = page.robots
+        links = list()
+        if 'nofollow' not in robots:
+            candidates = list()
+            for href in page.hrefs:
+                if 'mailto:' in href or href.startswith('#'):
+                    continue
+                candidates.append(urldefrag(urljoin(resp.raw_response.url, href)).url)
+            # Timed per page, timing every call would cost as much as is_valid.
+            # The canonical form is checked, the frontier canonicalizes the
+            # links again when it stores them and counts the rewritten ones.
+            with metrics.timer('is_valid'):
+                canonical = [canonicalize(link) for link in candidates]
+                valid = set(filter_urls(canonical))
+                links = [
+                    link for link, canonical_link in zip(candidates, canonical)
+                    if canonical_link in valid]
+            metrics.incr('links_checked', len(candidates))
+        if 'noindex' in robots:
+            return ParsedPage(links, None, None, None, NOINDEX)
+        
+        text = " ".join(page.text)
+        text_hash = content_hash(text)
+        if content_index is not None:
+            if is_exact_copy(url, content_index, text_hash):
+                return ParsedPage(links, None, None, None, EXACT_DUPLICATE)
+            text_hash = None
+        with metrics.timer('tokenize'):
+            tokens = tokenize(clean_text(text))
+        
+        if len(tokens) < 10:
+            dropped_pages.add(LOW_INFORMATION, url)
+            return ParsedPage(links, None, None, None, LOW_INFORMATION)
+
+        with metrics.timer('simhash'):
+            fingerprint = getFingerprint(page, tokens)
+        return ParsedPage(links, tokens, content, fingerprint, OK, text_hash)
+    except Exception as e:
+        error_logger.error(repr(e))
+        return ParsedPage(list(), None, None, None, ERROR)
+
+def record_page(url, parsed):
+    # Adds the page to the index and stores it unless it is a near duplicate
+    # of a page seen before, and returns the ParsedPage with its outcome.
+    # Runs where the index and page store live: the worker thread or the
+    # parse pool's coordinator. The dedupe and store stages of
+    # crawler/pipeline.py call the two halves.
+    if parsed.tokens is not None:
+        if is_exact_duplicate(url, parsed):
+            return parsed._replace(outcome=EXACT_DUPLICATE)
+        if is_near_duplicate(url, parsed):
+            return parsed._replace(outcome=NEAR_DUPLICATE)
+        store_page(url, parsed)
+    return parsed
+
+def is_exact_duplicate(url, parsed):
+    # For pages parsed without a content index. Tokenizing and the simhash
+    # were already paid for, the index lookup and the store are still saved.
+    if parsed.text_hash is None:
+        return False
+    return is_exact_copy(url, get_content_index(), parsed.text_hash,
+        ('simhash_query', 'simhash_add'))
+
+def is_exact_copy(url, content_index, text_hash,
+        saved_timers=('tokenize', 'simhash', 'simhash_query', 'simhash_add')):
+    # Adds text_hash to the index. A hash seen before is an exact copy, and
+    # the average time of the skipped steps is counted as saved.
+    metrics.incr('exact_checks')
+    if content_index.add(text_hash):
+        return False
+    metrics.incr('exact_duplicates')
+    metrics.incr('exact_duplicate_seconds_saved',
+        sum(metrics.mean(name) for name in saved_timers))
+    dropped_pages.add(EXACT_DUPLICATE, url)
+    return True
+
+def is_near_duplicate(url, parsed):
+    try:
+        similar_docs = getSimilarDocs(url, parsed.fingerprint)
+    except Exception as e:
+        error_logger.error(repr(e))
+        return False
+    if len(similar_docs) > 0:
+        metrics.incr('near_duplicates')
+        similar_docs_string = ', '.join(similar_docs)
+        dropped_pages.add(NEAR_DUPLICATE, url, f'{url} is similar to {similar_docs_string}')
+        return True
+    return False
+
+def store_page(url, parsed):
+    # Written in compressed blocks by the page store's own thread
+    filename = get_urlhash(url)
+    store = get_page_store()
+    metrics.incr('pages_stored')
+    store.put('tokens', filename, url, ' '.join(parsed.tokens).encode('utf-8'))
+    store.put('webpages', filename, url, parsed.content)
+
+def getFingerprint(page, text_tokens):
+    # text_tokens are the already tokenized page text
+    title_tokens, *heading_tokens = tokenize_many(
+        [page.title or ""] + page.headings)
+    tokens = [(word, 3) for word in title_tokens]
+    for words in heading_tokens:
+        tokens.extend((word, 2) for word in words)
+    tokens.extend((word, 1) for word in text_tokens)
+    return Simhash(tokens).value
+
+def getSimilarDocs(url, fingerprint):
+    index = get_index()
+    with index_lock:
+        with metrics.timer('simhash_query'):
+            similarDocs = index.get_fingerprint_matches(fingerprint)
+        with metrics.timer('simhash_add'):
+            index.add_fingerprint(url, fingerprint)
+    return similarDocs
+
+def remove_saved_state():
+    # Deletes the near-duplicate and exact-duplicate indexes and the page
+    # store, so a crawl restarted from the seeds, or replayed from the
+    # response cache, does not see its pages as duplicates of the last run.
+    # Must run before any of them is opened.
+    PersistentSimhashIndex.remove()
+    ContentHashIndex.remove()
+    PageStore.remove()
+
+def close_saved_state():
+    # Writes out and closes whichever of the indexes and the page store are
+    # open, when the crawl ends rather than at exit, by which time the
+    # directory they are in may be gone.
+    global index, content_index, page_store
+    with _open_lock:
+        for opened in (index, content_index, page_store):
+            if opened is not None:
+                opened.close()
+        index = content_index = page_store = None
+
+def get_index():
+    global index
+    with _open_lock:
+        if index is None:
+            index = PersistentSimhashIndex()
+    return index
+
+def get_content_index():
+    global content_index
+    with _open_lock:
+        if content_index is None:
+            content_index = ContentHashIndex()
+            metrics.gauge('exact_duplicate_rate', _exact_duplicate_rate)
+    return content_index
+
+def _exact_duplicate_rate():
+    return metrics.counter('exact_duplicates') / max(metrics.counter('exact_checks'), 1)
+
+def get_page_store():
+    global page_store
+    with _open_lock:
+        if page_store is None:
+            page_store = PageStore()
+    return page_store
@@ -0,0 +1,40 @@
+import random
+
+from simhash import Simhash, SimhashIndex
+from near_dup_index import FingerprintIndex
+from benchmarks.bench_near_dup_index import make_fingerprints
+
+SIZE = 6000
+URLS = [f"https://www.ics.uci.edu/page/{i}" for i in range(SIZE)]
+FINGERPRINTS = make_fingerprints(SIZE)
+QUERIES = random.Random(1).sample(FINGERPRINTS, 300)
+
+
+def reference_matches():
+    index = SimhashIndex([], k=5)
+    for url, value in zip(URLS, FINGERPRINTS):
+        index.add(url, Simhash(value))
+    return [sorted(index.get_near_dups(Simhash(value))) for value in QUERIES]
+
+
+REFERENCE = reference_matches()
+
+
+def test_matches_simhash_index():
+    index = FingerprintIndex(k=5)
+    # The first batch is put in tables, the second stays in the scanned tail.
+    index.add_many(URLS[:5000], FINGERPRINTS[:5000])
+    for url, value in zip(URLS[5000:], FINGERPRINTS[5000:]):
+        index.add(url, value)
+    assert len(index) == SIZE
+    assert [sorted(index.get_matches(value)) for value in QUERIES] == REFERENCE
+    assert [sorted(matches) for matches in index.get_matches_many(QUERIES)] == REFERENCE
+
+
+def test_save_and_load(tmp_path):
+    index = FingerprintIndex(k=5)
+    index.add_many(URLS, FINGERPRINTS)
+    index.freeze().save(str(tmp_path))
+    loaded = FingerprintIndex.load(str(tmp_path), URLS)
+    loaded.add_many(URLS[len(loaded):], FINGERPRINTS[len(loaded):])
+    assert [sorted(loaded.get_matches(value)) for value in QUERIES] == REFERENCE
@@ -0,0 +1,49 @@
+import os
+
+from page_store import PageStore, INDEX_ENTRY
+from utils import get_urlhash
+
+
+def put_pages(path, urls, text="a b c"):
+    store = PageStore(path, block_size=64)
+    for url in urls:
+        store.put('tokens', get_urlhash(url), url, f"{text} {url}".encode('utf-8'))
+    store.close()
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'pages')
+    urls = [f"https://www.ics.uci.edu/{i}" for i in range(20)]
+    put_pages(path, urls)
+    store = PageStore(path)
+    for url in urls:
+        assert store.get('tokens', get_urlhash(url)) == (url, f"a b c {url}".encode('utf-8'))
+    assert [url for _, url, _ in store.iter_records('tokens')] == urls
+
+
+def test_latest_skips_pages_stored_again(tmp_path):
+    path = str(tmp_path / 'pages')
+    urls = [f"https://www.ics.uci.edu/{i}" for i in range(10)]
+    put_pages(path, urls, "old")
+    put_pages(path, urls[5:], "new")
+    store = PageStore(path)
+    assert len(list(store.iter_records('tokens'))) == 15
+    latest = {url: payload for _, url, payload in store.iter_records('tokens', latest=True)}
+    assert sorted(latest) == sorted(urls)
+    assert latest[urls[7]].startswith(b"new")
+    assert store.get('tokens', get_urlhash(urls[7]))[1].startswith(b"new")
+
+
+def test_torn_index_tail(tmp_path):
+    path = str(tmp_path / 'pages')
+    urls = [f"https://www.ics.uci.edu/{i}" for i in range(10)]
+    put_pages(path, urls[:5])
+    # A crash while an entry was being written.
+    with open(os.path.join(path, 'index.bin'), 'ab') as f:
+        f.write(b'\0' * 20)
+    put_pages(path, urls[5:])
+    assert os.path.getsize(os.path.join(path, 'index.bin')) % INDEX_ENTRY.size == 0
+    store = PageStore(path)
+    for url in urls:
+        assert store.get('tokens', get_urlhash(url)) is not None
+    assert len(list(store.iter_records('tokens', latest=True))) == 10
@@ -0,0 +1,21 @@
+import tokenizer
+from benchmarks.bench_tokenizer import (
+    make_texts, old_scraper_tokenize, old_assignment_tokenize, old_word_frequencies)
+
+TEXTS = make_texts(200, 300)
+
+
+def test_tokenize_matches_nltk():
+    for text in TEXTS:
+        text = tokenizer.clean_text(text)
+        assert tokenizer.tokenize(text) == old_scraper_tokenize(text)
+
+
+def test_tokenize_words_matches_assignment_tokenizer():
+    for text in TEXTS:
+        assert tokenizer.tokenize_words(text) == old_assignment_tokenize(text)
+
+
+def test_word_frequencies():
+    tokens = [token for text in TEXTS[:10] for token in tokenizer.tokenize_words(text)]
+    assert dict(tokenizer.word_frequencies(tokens)) == dict(old_word_frequencies(tokens))
@@ -0,0 +1,34 @@
+import url_filter
+from benchmarks.bench_url_filter import old_is_valid, default_corpus
+
+CORPUS = default_corpus(20000)
+
+
+def test_is_valid_matches_old_filter():
+    differences = [
+        url for url in CORPUS if url_filter.is_valid(url) != old_is_valid(url)]
+    assert not differences[:20]
+
+
+def test_filter_urls_keeps_accepted_urls_in_order():
+    urls = CORPUS + CORPUS[:100]
+    assert url_filter.filter_urls(urls) == [url for url in urls if url_filter.is_valid(url)]
+
+
+def test_is_valid_rejects_what_is_not_an_url():
+    assert not url_filter.is_valid(None)
+    assert not url_filter.is_valid("mailto:someone@ics.uci.edu")
+
+
+class DisallowPeople(object):
+    def allowed(self, url):
+        return "/people" not in url
+
+
+def test_robots_rules():
+    url_filter.use_robots(DisallowPeople())
+    try:
+        assert not url_filter.is_valid("https://www.ics.uci.edu/people/faculty")
+        assert url_filter.is_valid("https://www.ics.uci.edu/about")
+    finally:
+        url_filter.use_robots(None)
@@ -0,0 +1,68 @@
+import re
+from collections import Counter
+from stopwords import stopwords
+
+# Set lookups instead of scanning the stopword list for every token.
+STOPWORDS = frozenset(stopwords)
+
+_NON_LETTERS = re.compile(r"[^a-z\s]")
+_NON_LETTERS_OR_SEPARATOR = re.compile(r"[^a-z\s\x00]")
+_WORDS = re.compile(r"\S+")
+_ALNUM_RUNS = re.compile(r"[^\W_]+")
+
+# Words that nltk.word_tokenize splits in two even without an apostrophe.
+# clean_text leaves only letters and whitespace, so these are the only
+# places where its output differs from splitting on whitespace.
+_SPLIT_WORDS = {
+    "cannot": ("can", "not"),
+    "gimme": ("gim", "me"),
+    "gonna": ("gon", "na"),
+    "gotta": ("got", "ta"),
+    "lemme": ("lem", "me"),
+    "wanna": ("wan", "na"),
+}
+
+def clean_text(text):
+    return _NON_LETTERS.sub('', text.lower())
+
+def tokenize(text):
+    ''' Tokens of text that went through clean_text, without stopwords and
+    words shorter than three letters. Gives the same tokens as
+    nltk.word_tokenize followed by those filters. '''
+    return _keep(_WORDS.findall(text))
+
+def tokenize_text(text):
+    return tokenize(clean_text(text))
+
+def tokenize_many(texts):
+    ''' tokenize_text for many texts with a single pass of the regexes over
+    all of them. '''
+    joined = '\x00'.join(text.replace('\x00', '') for text in texts)
+    cleaned = _NON_LETTERS_OR_SEPARATOR.sub('', joined.lower())
+    return [_keep(_WORDS.findall(chunk)) for chunk in cleaned.split('\x00')]
+
+def tokenize_words(text, unique=False):
+    ''' Lowercased runs of alphanumeric characters that are not stopwords,
+    as a set if unique. '''
+    tokens = (token.lower() for token in _ALNUM_RUNS.findall(text))
+    if unique:
+        return {token for token in tokens if token not in STOPWORDS}
+    return [token for token in tokens if token not in STOPWORDS]
+
+def word_frequencies(tokens, freqs=None):
+    ''' Counts tokens into freqs, a new Counter unless one is given. '''
+    if freqs is None:
+        freqs = Counter()
+    freqs.update(tokens)
+    return freqs
+
+def _keep(words):
+    tokens = []
+    for word in words:
+        if word in _SPLIT_WORDS:
+            tokens.extend(
+                part for part in _SPLIT_WORDS[word]
+                if len(part) > 2 and part not in STOPWORDS)
+        elif len(word) > 2 and word not in STOPWORDS:
+            tokens.append(word)
+    return tokens
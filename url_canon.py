@@ -0,0 +1,126 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
+
+# One canonical form for the spellings of a url, so the frontier stores and
+# fetches it once. The rules follow RFC 3986 section 6 plus the trailing
+# slash that utils.normalize used to strip.
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Query and ;path parameters that only carry a session or tracking id. A
+# name ending in * matches every parameter starting with the rest.
+DEFAULT_STRIP_PARAMS = (
+    "utm_*", "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid",
+    "_ga", "_gl", "jsessionid", "phpsessid", "sessionid", "sid", "session_id")
+PERCENT_ESCAPE = re.compile(r"%[0-9a-fA-F]{2}")
+UNRESERVED = frozenset(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-._~")
+
+_strip_names = frozenset()
+_strip_prefixes = ()
+
+
+def configure(strip_params=DEFAULT_STRIP_PARAMS):
+    ''' Sets the parameters that canonicalize strips. Called with
+    config.strip_params by the crawler and in every parser process. '''
+    global _strip_names, _strip_prefixes
+    params = [param.strip().lower() for param in strip_params if param.strip()]
+    _strip_names = frozenset(param for param in params if not param.endswith("*"))
+    _strip_prefixes = tuple(param[:-1] for param in params if param.endswith("*"))
+    canonicalize.cache_clear()
+
+
+@lru_cache(maxsize=65536)
+def canonicalize(url):
+    ''' The canonical form of an absolute url: lowercase scheme and host,
+    no default port, no fragment, dot segments resolved, percent escapes
+    of unreserved characters decoded and the others uppercased, session
+    and tracking parameters removed, query parameters sorted and no
+    trailing slash. A url that can not be parsed is returned as it is. '''
+    try:
+        parsed = urlsplit(url.strip())
+        scheme = parsed.scheme.lower()
+        netloc = _canonical_netloc(scheme, parsed)
+    except ValueError:
+        return url
+    path = remove_dot_segments(_percent_normalize(parsed.path))
+    if ";" in path:
+        path = _strip_path_params(path)
+    query = _canonical_query(parsed.query) if parsed.query else ""
+    return urlunsplit((scheme, netloc, path, query, "")).rstrip("/")
+
+
+def _canonical_netloc(scheme, parsed):
+    host = parsed.hostname or ""
+    if ":" in host:
+        # IPv6 literal
+        host = f"[{host}]"
+    port = parsed.port
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    userinfo, at, _ = parsed.netloc.rpartition("@")
+    return f"{userinfo}{at}{host}"
+
+
+def _percent_normalize(text):
+    if "%" not in text:
+        return text
+    return PERCENT_ESCAPE.sub(_normalize_escape, text)
+
+
+def _normalize_escape(match):
+    char = chr(int(match.group()[1:], 16))
+    return char if char in UNRESERVED else match.group().upper()
+
+
+def remove_dot_segments(path):
+    ''' Resolves . and .. segments of a path, RFC 3986 section 5.2.4. '''
+    if "." not in path:
+        return path
+    segments = path.split("/")
+    output = list()
+    for segment in segments:
+        if segment == ".":
+            continue
+        if segment == "..":
+            if len(output) > 1:
+                output.pop()
+            continue
+        output.append(segment)
+    if segments[-1] in (".", ".."):
+        # A path ending in a dot segment names a directory.
+        output.append("")
+    return "/".join(output)
+
+
+def _is_stripped(name):
+    name = name.lower()
+    return name in _strip_names or name.startswith(_strip_prefixes)
+
+
+def _strip_path_params(path):
+    # /page;jsessionid=1234 keeps the path and drops the parameter.
+    segments = list()
+    for segment in path.split("/"):
+        name, *params = segment.split(";")
+        params = [
+            param for param in params
+            if not _is_stripped(param.partition("=")[0])]
+        segments.append(";".join([name] + params))
+    return "/".join(segments)
+
+
+def _canonical_query(query):
+    params = list()
+    for param in query.split("&"):
+        if not param:
+            continue
+        param = _percent_normalize(param)
+        name = param.partition("=")[0]
+        if not _is_stripped(name):
+            params.append((name, param))
+    params.sort()
+    return "&".join(param for _, param in params)
+
+
+configure()
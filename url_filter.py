@@ -0,0 +1,137 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit, urlparse, SplitResult
+
+from utils import get_logger
+
+# The rules of the crawl, checked from cheapest to most expensive. Every
+# check gives the same verdict as the chain of re.match calls is_valid used
+# to run; benchmarks/bench_url_filter.py compares the two.
+
+SCHEMES = frozenset(["http", "https"])
+# File types that are not crawled, matched against the text after the last
+# dot of the path.
+EXTENSIONS = frozenset("""
+    src rpm css js bmp gif jpg jpeg ico
+    png tif tiff mid mp2 mp3 mp4
+    wav avi mov mpeg ram m4v mkv ogg ogv pdf
+    ps eps tex ppt pptx doc docx xls xlsx names
+    data dat exe bz2 tar msi bin 7z psd dmg iso
+    epub dll cnf tgz sha1
+    thmx mso arff rtf jar csv
+    rm smil wmv swf wma zip rar gz sql txt ppsx img ff
+    """.split())
+# calendar link, download, login, sharing to twitter or facebook
+TRAP_QUERY = re.compile(r"ical|tribe_events?|tribe-bar-date|action=|share=(twitter|facebook)|do=")
+# filter dates for calendars
+CALENDAR_PATH = re.compile(r"/(events|day|month).*/\d{4}-\d{2}(-\d{2})?")
+# Hosts of the crawl. ics and informatics end in cs, so cs covers them.
+ALLOWED_HOST = re.compile(r"(cs|stat|today)\.uci\.edu")
+# I used the regex from https://support.archive-it.org/hc/en-us/articles/208332963-Modify-crawl-scope-with-a-Regular-Expression which blocks URLS with repeated paths, but I modified it for my own needs to include repeated numbers in paths
+REPEATED_PATH = re.compile(r"^.*?(/[a-zA-Z]+?/).*?\1.*$|^.*?/([a-zA-Z]+?/)\2.*$")
+# Has repeated paths but has content and is not a crawler trap.
+REPEATED_PATH_EXCEPTION = "grape.ics.uci.edu/wiki/public/wiki"
+ASCII_LETTERS = frozenset("abcdefghijklmnopqrstuvwxyz")
+URL_UNSAFE_CHARS = frozenset("\t\r\n")
+# robots.RobotsCache of the crawl, see use_robots.
+_robots = None
+error_logger = get_logger("errors")
+
+
+def use_robots(robots):
+    ''' Makes is_valid reject the urls that robots, a robots.RobotsCache,
+    knows to be disallowed. None turns the check off. Set by the frontier
+    of the crawl. '''
+    global _robots
+    _robots = robots
+
+
+def is_valid(url):
+    # Decide whether to crawl this url or not.
+    # If you decide to crawl it, return True; otherwise return False.
+    try:
+        # robots.txt paths are case sensitive.
+        original = url
+        url = url.lower()
+        # The hostname is part of the url, unless urlsplit drops the tabs and
+        # newlines that split it.
+        if ALLOWED_HOST.search(url) is None and not URL_UNSAFE_CHARS.intersection(url):
+            return False
+        parsed = urlsplit(url)
+        if ";" in parsed.path:
+            # Only urlparse splits ;params off the path.
+            parsed = urlparse(url)
+        if parsed.scheme not in SCHEMES:
+            return False
+        allowed, today, gitlab = host_rules(parsed.netloc)
+        if not allowed:
+            return False
+        path = parsed.path
+        if today and "department/information_computer_sciences" not in path:
+            return False
+        if gitlab and ("commit" in path or "tag" in path):
+            return False
+        # french page
+        if ".fr" in path or "calendar" in url:
+            return False
+        # file uploads and login form
+        if "/wp-content" in path or "/wp-login" in path:
+            return False
+        dot = path.rfind(".")
+        if dot != -1 and path[dot + 1:] in EXTENSIONS:
+            return False
+        if parsed.query and TRAP_QUERY.search(parsed.query):
+            return False
+        if path.startswith(("/events", "/day", "/month")) and CALENDAR_PATH.match(path):
+            return False
+        if has_repeated_path(url) and REPEATED_PATH_EXCEPTION not in url:
+            return False
+        if _robots is not None and not _robots.allowed(original):
+            return False
+        return True
+
+    except Exception as e:
+        error_logger.error(f"Failed to check {url}: {e!r}")
+        return False
+
+
+def filter_urls(urls):
+    ''' The urls that is_valid accepts, in order. Repeated urls are only
+    checked once. '''
+    verdicts = dict()
+    valid = list()
+    for url in urls:
+        verdict = verdicts.get(url)
+        if verdict is None:
+            verdict = verdicts[url] = is_valid(url)
+        if verdict:
+            valid.append(url)
+    return valid
+
+
+@lru_cache(maxsize=65536)
+def host_rules(netloc):
+    ''' (allowed, today, gitlab) verdicts for the hostname of a lowercased
+    netloc. '''
+    hostname = SplitResult("", netloc, "", "", "").hostname
+    if not hostname:
+        return False, False, False
+    return (
+        ALLOWED_HOST.search(hostname) is not None,
+        "today.uci.edu" in hostname,
+        "gitlab" in hostname)
+
+
+def has_repeated_path(url):
+    ''' True if REPEATED_PATH matches the lowercased url, which is when the
+    same run of letters is a whole segment between two slashes twice. '''
+    if "\n" in url:
+        # . does not match newlines, leave those to the regex.
+        return REPEATED_PATH.match(url) is not None
+    seen = set()
+    for segment in url.split("/")[1:-1]:
+        if segment and ASCII_LETTERS.issuperset(segment):
+            if segment in seen:
+                return True
+            seen.add(segment)
+    return False
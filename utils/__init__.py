@@ -1,33 +1,204 @@
 import os
+import sys
+import time
+import atexit
 import logging
+from queue import SimpleQueue
 from hashlib import sha256
+from threading import Thread, Lock
 from urllib.parse import urlparse
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing.util import Finalize
+
+# Every logger of a process puts its records on one queue, and a listener
+# thread writes them, so logging never waits for a file or the console.
+_log_lock = Lock()
+_log_queue = None
+_log_pid = None
+# Listener of this process until it is stopped.
+_log_listener = None
+# Log path -> file, opened with the first logger that writes to it, so a
+# run whose directory is gone by the time the last records are written
+# still has somewhere to put them.
+_log_files = dict()
+_log_formatter = logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
 
 def get_logger(name, filename=None):
+    ''' Logger that writes to Logs/<filename or name>.log and the console
+    through the log queue of the process. Calling this again with the same
+    name returns the same logger without adding handlers. '''
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    if not os.path.exists("Logs"):
-        os.makedirs("Logs")
-    fh = logging.FileHandler(f"Logs/{filename if filename else name}.log")
-    fh.setLevel(logging.DEBUG)
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-       "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+    with _log_lock:
+        if _log_handler not in logger.handlers:
+            os.makedirs("Logs", exist_ok=True)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            path = os.path.abspath(f"Logs/{filename if filename else name}.log")
+            if path not in _log_files:
+                _log_files[path] = open(path, "a", encoding="utf-8")
+            logger.addFilter(_LogPath(path))
+            logger.addHandler(_log_handler)
     return logger
 
 
+class _ProcessQueueHandler(QueueHandler):
+    # Puts records on the queue of the current process, which a process
+    # started by fork sets up again on its first record.
+    def __init__(self):
+        super().__init__(None)
+
+    def enqueue(self, record):
+        queue = _log_queue if _log_pid == os.getpid() else _start_log_listener()
+        queue.put_nowait(record)
+
+
+def _start_log_listener():
+    global _log_queue, _log_pid, _log_listener
+    with _log_lock:
+        if _log_pid != os.getpid():
+            queue = SimpleQueue()
+            listener = QueueListener(queue, _LogWriter(queue))
+            listener.start()
+            _log_queue, _log_pid, _log_listener = queue, os.getpid(), listener
+            # Parser processes leave through multiprocessing, which skips
+            # atexit but runs its finalizers.
+            atexit.register(_stop_log_listener, listener)
+            Finalize(None, _stop_log_listener, args=(listener,), exitpriority=0)
+        return _log_queue
+
+
+def _stop_log_listener(listener):
+    # Registered with both atexit and Finalize, and copied into forked
+    # processes, so only the first call in the process that started the
+    # listener stops it.
+    global _log_listener
+    with _log_lock:
+        if _log_listener is not listener:
+            return
+        _log_listener = None
+    listener.stop()
+
+
+class _LogPath(logging.Filter):
+    # Tags the records of a logger with the file they go to.
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def filter(self, record):
+        record.log_path = self.path
+        return True
+
+
+class _LogWriter(logging.Handler):
+    ''' Writes the records taken off the queue to their files and to the
+    console. Files are only flushed once the queue is empty, so a burst of
+    records costs one write per file instead of one per line. '''
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+        self.setFormatter(_log_formatter)
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + "\n"
+            _log_files[record.log_path].write(line)
+            sys.stderr.write(line)
+            if self.queue.empty():
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        _flush_log_files()
+        sys.stderr.flush()
+
+    def close(self):
+        # The files stay open for the loggers, and a forked process shares
+        # them, so they are only flushed.
+        self.flush()
+        super().close()
+
+
+_log_handler = _ProcessQueueHandler()
+
+
+def _flush_log_files():
+    # A forked process shares the files, and would write out again what is
+    # still in their buffers.
+    for f in list(_log_files.values()):
+        try:
+            f.flush()
+        except ValueError:
+            pass
+
+
+os.register_at_fork(before=_flush_log_files)
+
+
+class EventSummary(object):
+    ''' Counts frequent events, like near duplicates, per kind and host and
+    logs one line for each every interval seconds, "12 near_duplicate from
+    www.ics.uci.edu in the last 60s, e.g. <first one>", instead of a line
+    per event. A thread started with the first event of a process logs
+    them, so a burst is logged even when no event follows it. '''
+    def __init__(self, logger, interval=60.0):
+        self.logger = logger
+        self.interval = interval
+        self.lock = Lock()
+        # (kind, host) -> [count, first example]
+        self.events = dict()
+        self.started = time.time()
+        self.pid = None
+
+    def add(self, kind, url, example=None):
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            if self.pid != os.getpid():
+                # The counts copied into a forked process are not its own.
+                self.pid = os.getpid()
+                self.events = dict()
+                self.started = time.time()
+                # Registered after the log listener, so it runs before the
+                # listener stops.
+                _start_log_listener()
+                atexit.register(self.flush)
+                Finalize(None, self.flush, exitpriority=10)
+                Thread(target=self._flush_loop, daemon=True).start()
+            event = self.events.get((kind, host))
+            if event is None:
+                self.events[(kind, host)] = [1, example or url]
+            else:
+                event[0] += 1
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, dict()
+            seconds = time.time() - self.started
+            self.started = time.time()
+        for (kind, host), (count, example) in sorted(events.items()):
+            self.logger.info(
+                f"{count} {kind} from {host} in the last {seconds:.0f}s, "
+                f"e.g. {example}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
 def get_urlhash(url):
+    return get_urldigest(url).hex()
+
+def get_urldigest(url):
+    ''' The sha256 digest that get_urlhash is the hex of. '''
     parsed = urlparse(url)
     # everything other than scheme.
     return sha256(
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
-        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
+        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).digest()
 
 def normalize(url):
     if url.endswith("/"):
@@ -0,0 +1,63 @@
+import os
+import atexit
+from threading import Thread, Lock, Event
+
+
+class AppendLog(object):
+    ''' Records waiting to be appended to an index's files on disk. add
+    queues a record, and a background thread hands the records queued
+    since the last time to write every interval seconds, and once more on
+    close, which also runs at exit. write appends them with append_file. '''
+    def __init__(self, write, interval=1.0):
+        self.write = write
+        self.interval = interval
+        self.lock = Lock()
+        self.pending = list()
+        self.closed = Event()
+        self.flusher = Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def add(self, record):
+        with self.lock:
+            self.pending.append(record)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, list()
+        if pending:
+            self.write(pending)
+
+    def close(self):
+        if not self.closed.is_set():
+            self.closed.set()
+            self.flusher.join()
+            self.flush()
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.interval):
+            self.flush()
+
+
+def append_file(path, data):
+    ''' Appends the bytes data to path and syncs it to disk. '''
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_records(path, size):
+    ''' The records of size bytes in path, b"" if there is no file. A crash
+    can leave a torn record at the end, which is cut off the file, so the
+    records appended next are whole. '''
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return b""
+    torn = len(data) % size
+    if torn:
+        data = data[:-torn]
+        os.truncate(path, len(data))
+    return data
@@ -1,5 +1,7 @@
 import re
 
+from url_canon import DEFAULT_STRIP_PARAMS
+
 
 class Config(object):
     def __init__(self, config):
@@ -9,11 +11,46 @@ class Config(object):
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.store = config["LOCAL PROPERTIES"].get("STORE", "shelve").strip().lower()
+        self.commit_interval = float(config["LOCAL PROPERTIES"].get("COMMITINTERVAL", "1"))
+        self.download_mode = config["LOCAL PROPERTIES"].get("DOWNLOADMODE", "sync").strip().lower()
+        assert self.download_mode in ("sync", "async", "pipeline"), "DOWNLOADMODE should be sync, async or pipeline"
+        self.async_tasks = int(config["LOCAL PROPERTIES"].get("ASYNCTASKS", "100"))
+        self.parse_processes = int(config["LOCAL PROPERTIES"].get("PARSEPROCESSES", "0"))
+        self.stage_threads = {
+            stage: int(config["LOCAL PROPERTIES"].get(f"{stage.upper()}THREADS", "1"))
+            for stage in ("extract", "dedupe", "store", "frontier")}
+        self.queue_size = int(config["LOCAL PROPERTIES"].get("QUEUESIZE", "64"))
+        self.metrics_file = config["LOCAL PROPERTIES"].get("METRICSFILE", "Logs/metrics.json").strip()
+        self.metrics_interval = float(config["LOCAL PROPERTIES"].get("METRICSINTERVAL", "10"))
+        self.metrics_port = int(config["LOCAL PROPERTIES"].get("METRICSPORT", "0"))
+        self.response_cache = config["LOCAL PROPERTIES"].get("RESPONSECACHE", "").strip()
+        self.response_cache_size = int(float(
+            config["LOCAL PROPERTIES"].get("RESPONSECACHEMB", "10240")) * 2 ** 20)
+        # Set by launch.py --replay.
+        self.replay = False
+        self.nodes = int(config["LOCAL PROPERTIES"].get("NODES", "1"))
+        self.cluster_dir = config["LOCAL PROPERTIES"].get("CLUSTERDIR", "cluster").strip()
+        # Set by launch.py --node, see crawler/cluster.py.
+        self.node_id = None
+        self.spool_dir = None
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.download_timeout = float(config["CONNECTION"].get("TIMEOUT", "30"))
+        self.download_retries = int(config["CONNECTION"].get("RETRIES", "2"))
+        self.retry_backoff = float(config["CONNECTION"].get("RETRYBACKOFF", "1"))
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
+        self.strip_params = (
+            config["CRAWLER"]["STRIPPARAMS"].split(",")
+            if "STRIPPARAMS" in config["CRAWLER"] else DEFAULT_STRIP_PARAMS)
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.trap_min_fetches = int(config["CRAWLER"].get("TRAPMINFETCHES", "20"))
+        self.trap_min_yield = float(config["CRAWLER"].get("TRAPMINYIELD", "0.2"))
+        self.pattern_budget = int(config["CRAWLER"].get("PATTERNBUDGET", "0"))
+        self.host_budget = int(config["CRAWLER"].get("HOSTBUDGET", "0"))
+        self.obey_robots = config["CRAWLER"].getboolean("ROBOTS", True)
+        self.robots_ttl = float(config["CRAWLER"].get("ROBOTSTTL", "86400"))
 
         self.cache_server = None
\ No newline at end of file
@@ -2,22 +2,149 @@ import requests
 import cbor
 import time
 
+from threading import local, Lock
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
 from utils.response import Response
+from utils.metrics import metrics
+from utils.response_cache import ResponseCache
+
+# Every thread keeps its own keep-alive session to the cache server.
+_sessions = local()
+# Opened on first use when config.response_cache is set.
+_response_cache = None
+_cache_lock = Lock()
+
+def get_session():
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sessions.session = session
+    return session
+
+def get_response_cache(config):
+    ''' The ResponseCache of config.response_cache, or None. '''
+    global _response_cache
+    if not config.response_cache:
+        return None
+    with _cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                config.response_cache, config.response_cache_size,
+                config.commit_interval)
+    return _response_cache
+
+def close_response_cache():
+    global _response_cache
+    with _cache_lock:
+        if _response_cache is not None:
+            _response_cache.close()
+            _response_cache = None
+
+def cached_response(url, config, logger=None):
+    ''' The Response for url from the response cache, or None if it has to
+    be downloaded. In replay mode a url that is not cached gets an error
+    Response instead, nothing is downloaded. '''
+    cache = get_response_cache(config)
+    if cache is None:
+        return None
+    # Timed apart from downloads, so the download latencies and pages per
+    # second only count round trips to the cache server.
+    with metrics.timer("response_cache_get"):
+        cached = cache.get(url)
+    if cached is None:
+        if not config.replay:
+            return None
+        return Response({
+            "error": f"{url} is not in the response cache.",
+            "status": 0,
+            "url": url})
+    status, content, headers = cached
+    return make_response(url, True, status, content, headers, logger)
+
+def cache_response(url, config, ok, status_code, content, headers):
+    cache = get_response_cache(config)
+    if cache is not None and ok and content:
+        cache.put(url, status_code, content, headers)
 
 def download(url, config, logger=None):
+    resp = cached_response(url, config, logger)
+    if resp is not None:
+        return resp
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    start = time.perf_counter()
+    for attempt in range(config.download_retries + 1):
+        try:
+            resp = get_session().get(
+                f"http://{host}:{port}/",
+                params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+                timeout=config.download_timeout)
+            break
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == config.download_retries:
+                metrics.incr("download_errors")
+                raise
+            metrics.incr("download_retries")
+            time.sleep(config.retry_backoff * 2 ** attempt)
+    metrics.observe_download(
+        urlparse(url).hostname or "", time.perf_counter() - start)
+    cache_response(
+        url, config, resp.ok, resp.status_code, resp.content, resp.headers)
+    return make_response(
+        url, resp.ok, resp.status_code, resp.content, resp.headers, logger)
+
+def make_response(url, ok, status_code, content, headers, logger=None):
+    ''' Builds the Response for one reply of the cache server. Shared by the
+    blocking and the asyncio download paths. '''
     try:
-        if resp and resp.content:
-            data = cbor.loads(resp.content)
-            data['headers'] = resp.headers
+        if ok and content:
+            data = cbor.loads(content)
+            data['headers'] = headers
             return Response(data)
     except (EOFError, ValueError) as e:
         pass
-    logger.error(f"Spacetime Response error {resp} with url {url}.")
+    if logger:
+        logger.error(f"Spacetime Response error {status_code} with url {url}.")
     return Response({
-        "error": f"Spacetime Response error {resp} with url {url}.",
-        "status": resp.status_code,
+        "error": f"Spacetime Response error {status_code} with url {url}.",
+        "status": status_code,
         "url": url})
+
+async def download_async(url, config, session, logger=None):
+    ''' asyncio counterpart of download, using an aiohttp.ClientSession so
+    many fetches can be in flight from a single thread. '''
+    import asyncio
+    import aiohttp
+
+    # The cache is read from the event loop, it is a local file.
+    resp = cached_response(url, config, logger)
+    if resp is not None:
+        return resp
+    host, port = config.cache_server
+    timeout = aiohttp.ClientTimeout(total=config.download_timeout)
+    start = time.perf_counter()
+    for attempt in range(config.download_retries + 1):
+        try:
+            async with session.get(
+                    f"http://{host}:{port}/",
+                    params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+                    timeout=timeout) as resp:
+                content = await resp.read()
+                metrics.observe_download(
+                    urlparse(url).hostname or "", time.perf_counter() - start)
+                cache_response(
+                    url, config, resp.status < 400, resp.status, content,
+                    resp.headers)
+                return make_response(
+                    url, resp.status < 400, resp.status, content,
+                    resp.headers, logger)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == config.download_retries:
+                metrics.incr("download_errors")
+                raise
+            metrics.incr("download_retries")
+            await asyncio.sleep(config.retry_backoff * 2 ** attempt)
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import bisect
+
+from threading import Thread, Lock, Event
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Upper bounds of the latency buckets in seconds, from 50 microseconds to
+# about a minute.
+BUCKETS = tuple(0.00005 * 2 ** i for i in range(21))
+
+
+class Histogram(object):
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        ''' Upper bound of the bucket holding the q quantile. '''
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _Timer(object):
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics(object):
+    ''' Counters, latency histograms and per-host download tallies of the
+    crawler. Recording takes a lock and a few additions, gauges are
+    callables that are only read when a snapshot is taken. '''
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.time()
+        self.counters = dict()
+        self.histograms = dict()
+        self.hosts = dict()
+        self.gauges = dict()
+        # Pages per second over the last second or more.
+        self._last_rate = (self.started, 0)
+        self._rate = 0.0
+
+    def timer(self, name):
+        ''' Context manager that records the time spent in it. '''
+        return _Timer(self, name)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe_download(self, host, seconds):
+        ''' Records a downloaded page, overall and for its host. '''
+        with self.lock:
+            histogram = self.histograms.get("download")
+            if histogram is None:
+                histogram = self.histograms["download"] = Histogram()
+            histogram.observe(seconds)
+            tally = self.hosts.get(host)
+            if tally is None:
+                tally = self.hosts[host] = [0, 0.0]
+            tally[0] += 1
+            tally[1] += seconds
+
+    def counter(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def mean(self, name):
+        ''' Mean of the times recorded under name, 0 if there are none. '''
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None or not histogram.count:
+                return 0.0
+            return histogram.total / histogram.count
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def snapshot(self):
+        now = time.time()
+        gauges = dict()
+        for name, read in list(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception:
+                pass
+        with self.lock:
+            pages = self.histograms["download"].count if "download" in self.histograms else 0
+            last_time, last_pages = self._last_rate
+            if now - last_time >= 1.0:
+                self._rate = (pages - last_pages) / (now - last_time)
+                self._last_rate = (now, pages)
+            return {
+                "time": now,
+                "uptime": now - self.started,
+                "pages": pages,
+                "pages_per_second": self._rate,
+                "pages_per_second_total": pages / max(now - self.started, 1e-9),
+                "counters": dict(self.counters),
+                "gauges": gauges,
+                "latency": {
+                    name: {
+                        "count": histogram.count,
+                        "sum": histogram.total,
+                        "mean": histogram.total / histogram.count if histogram.count else 0.0,
+                        "p50": histogram.quantile(0.5),
+                        "p90": histogram.quantile(0.9),
+                        "p99": histogram.quantile(0.99)}
+                    for name, histogram in self.histograms.items()},
+                "hosts": {
+                    host: {"pages": count, "seconds": seconds}
+                    for host, (count, seconds) in self.hosts.items()},
+            }
+
+    def prometheus(self):
+        ''' The current values in the Prometheus text format. '''
+        snapshot = self.snapshot()
+        with self.lock:
+            histograms = {
+                name: (list(histogram.counts), histogram.count, histogram.total)
+                for name, histogram in self.histograms.items()}
+        lines = [
+            "# TYPE crawler_pages_per_second gauge",
+            f"crawler_pages_per_second {snapshot['pages_per_second']}"]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE crawler_{name}_total counter")
+            lines.append(f"crawler_{name}_total {value}")
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"# TYPE crawler_{name} gauge")
+            lines.append(f"crawler_{name} {value}")
+        for name, (counts, count, total) in sorted(histograms.items()):
+            lines.append(f"# TYPE crawler_{name}_seconds histogram")
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                lines.append(f'crawler_{name}_seconds_bucket{{le="{bound:g}"}} {cumulative}')
+            lines.append(f'crawler_{name}_seconds_bucket{{le="+Inf"}} {count}')
+            lines.append(f"crawler_{name}_seconds_sum {total}")
+            lines.append(f"crawler_{name}_seconds_count {count}")
+        lines.append("# TYPE crawler_host_pages_total counter")
+        for host, tally in sorted(snapshot["hosts"].items()):
+            lines.append(f'crawler_host_pages_total{{host="{host}"}} {tally["pages"]}')
+        lines.append("# TYPE crawler_host_download_seconds_total counter")
+        for host, tally in sorted(snapshot["hosts"].items()):
+            lines.append(f'crawler_host_download_seconds_total{{host="{host}"}} {tally["seconds"]}')
+        return "\n".join(lines) + "\n"
+
+
+# Shared by every thread of the process. Parser processes have their own,
+# which is not reported.
+metrics = Metrics()
+
+
+def merge_snapshots(snapshots):
+    ''' One snapshot for several crawler processes, such as the nodes of a
+    partitioned crawl: counters, pages, rates and latency counts and sums
+    are added up and host tallies joined. The quantiles are the largest of
+    any process, and the gauges of every process are kept under "nodes". '''
+    merged = {
+        "time": max(snapshot["time"] for snapshot in snapshots),
+        "uptime": max(snapshot["uptime"] for snapshot in snapshots),
+        "counters": dict(), "latency": dict(), "hosts": dict(),
+        "nodes": [snapshot["gauges"] for snapshot in snapshots]}
+    for key in ("pages", "pages_per_second", "pages_per_second_total"):
+        merged[key] = sum(snapshot[key] for snapshot in snapshots)
+    for snapshot in snapshots:
+        for name, value in snapshot["counters"].items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+        for name, latency in snapshot["latency"].items():
+            total = merged["latency"].setdefault(
+                name, {"count": 0, "sum": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0})
+            total["count"] += latency["count"]
+            total["sum"] += latency["sum"]
+            for quantile in ("p50", "p90", "p99"):
+                total[quantile] = max(total[quantile], latency[quantile])
+        merged["hosts"].update(snapshot["hosts"])
+    for latency in merged["latency"].values():
+        latency["mean"] = latency["sum"] / latency["count"] if latency["count"] else 0.0
+    return merged
+
+
+class MetricsReporter(Thread):
+    ''' Writes a snapshot of metrics to path every interval seconds, as
+    Prometheus text if path ends in .prom and as JSON otherwise, and serves
+    /metrics (Prometheus text) and /stats (JSON) on localhost:port when port
+    is set. '''
+    def __init__(self, metrics, path=None, interval=10.0, port=0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self.stopped = Event()
+        self.server = None
+        super().__init__(daemon=True)
+
+    def start(self):
+        if self.port:
+            self.server = ThreadingHTTPServer(
+                ("127.0.0.1", self.port), _handler(self.metrics))
+            self.server.daemon_threads = True
+            Thread(target=self.server.serve_forever, daemon=True).start()
+        super().start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def write(self):
+        if not self.path:
+            return
+        if self.path.endswith(".prom"):
+            text = self.metrics.prometheus()
+        else:
+            text = json.dumps(self.metrics.snapshot(), indent=1, sort_keys=True)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+
+def _handler(metrics):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics"):
+                body = metrics.prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4"
+            elif self.path.startswith("/stats") or self.path == "/":
+                body = json.dumps(metrics.snapshot(), sort_keys=True).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return MetricsHandler
@@ -1,15 +1,37 @@
 import pickle
 
 class Response(object):
+    ''' One reply of the cache server. url, status, headers and error are
+    read up front. The page itself arrives as a pickled requests.Response
+    and is only unpickled when raw_response or content is first used, so
+    pages rejected by status or headers are never unpickled. '''
     def __init__(self, resp_dict):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.headers = resp_dict["headers"] if "headers" in resp_dict else None
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        self._pickled = resp_dict["response"] if "response" in resp_dict else None
+        self._raw_response = None
+
+    @property
+    def raw_response(self):
+        if self._pickled is not None:
+            try:
+                self._raw_response = pickle.loads(self._pickled)
+            except TypeError:
+                self._raw_response = None
+            # Dropped, so the page is not held both pickled and unpickled.
+            self._pickled = None
+        return self._raw_response
+
+    @raw_response.setter
+    def raw_response(self, raw_response):
+        self._pickled = None
+        self._raw_response = raw_response
+
+    @property
+    def content(self):
+        ''' Body of the page as the bytes object of raw_response, not a
+        copy, or None when there is no page. '''
+        raw_response = self.raw_response
+        return raw_response.content if raw_response is not None else None
@@ -0,0 +1,177 @@
+import os
+import gzip
+import json
+import time
+import sqlite3
+
+from hashlib import sha256
+from threading import Lock
+from requests.structures import CaseInsensitiveDict
+
+from utils.metrics import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Blob files start with the codec, so a cache written with zstandard is
+# still read correctly without it, or the other way around.
+GZIP, ZSTD = b"g", b"z"
+
+
+class ResponseCache(object):
+    ''' On-disk cache of the replies of the cache server, for rerunning a
+    crawl without downloading it again. Every reply is kept whole, as it is
+    handed to utils.response.Response, and compressed into
+    <path>/blobs/<sha256 of the reply>, so a url fetched again with the same
+    reply is kept once. <path>/index.db maps every url to its blob, status
+    and headers. Once the blobs take more than max_bytes, the least recently
+    used ones are dropped together with their urls. Only successful replies
+    are cached. Reads and writes of the index are committed once per
+    commit_interval seconds. '''
+    def __init__(self, path, max_bytes, commit_interval=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.commit_interval = commit_interval
+        self.codec = ZSTD if zstandard is not None else GZIP
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        self.lock = Lock()
+        self.db = sqlite3.connect(
+            os.path.join(path, "index.db"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            "url TEXT PRIMARY KEY, digest TEXT NOT NULL, "
+            "status INTEGER NOT NULL, headers TEXT NOT NULL) WITHOUT ROWID")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(urls)")}
+        if "reply" in columns:
+            # Written when blobs held only the page, with the rest of the
+            # reply in this column. Those urls are fetched again.
+            self.db.execute("DELETE FROM urls WHERE reply IS NOT NULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "digest TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "used REAL NOT NULL) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS lru ON blobs (used)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS blob_urls ON urls (digest)")
+        self.db.commit()
+        self.size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        # digest -> time of the hits not written to the index yet.
+        self.used = dict()
+        self.dirty = False
+        self.last_commit = time.time()
+        metrics.gauge("response_cache_bytes", lambda: self.size)
+
+    def get(self, url):
+        ''' (status, content, headers) of the cached reply for url, or
+        None. '''
+        with self.lock:
+            row = self.db.execute(
+                "SELECT digest, status, headers FROM urls WHERE url = ?",
+                (url,)).fetchone()
+            if row is not None:
+                self.used[row[0]] = time.time()
+                self._written()
+        if row is None:
+            metrics.incr("response_cache_misses")
+            return None
+        digest, status, headers = row
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                content = _decompress(f.read())
+        except Exception:
+            # Evicted meanwhile, or torn by a crash.
+            metrics.incr("response_cache_misses")
+            return None
+        metrics.incr("response_cache_hits")
+        return status, content, CaseInsensitiveDict(json.loads(headers))
+
+    def put(self, url, status, content, headers):
+        # The reply is not decoded here, that would unpickle every page on
+        # the download thread, see utils.response.Response.
+        digest = sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+        else:
+            data = _compress(self.codec, content)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{id(data)}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            size = len(data)
+        with self.lock:
+            if self.db.execute(
+                    "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)",
+                    (digest, size, time.time())).rowcount:
+                self.size += size
+            self.used[digest] = time.time()
+            self.db.execute(
+                "INSERT OR REPLACE INTO urls (url, digest, status, headers) "
+                "VALUES (?, ?, ?, ?)",
+                (url, digest, status, json.dumps(dict(headers or {}))))
+            self._written()
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.db.close()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, "blobs", digest[:2], digest)
+
+    def _written(self):
+        self.dirty = True
+        if time.time() - self.last_commit >= self.commit_interval:
+            self._commit()
+
+    def _commit(self):
+        if not self.dirty:
+            return
+        self.db.executemany(
+            "UPDATE blobs SET used = ? WHERE digest = ?",
+            [(used, digest) for digest, used in self.used.items()])
+        self.used = dict()
+        if self.size > self.max_bytes:
+            self._evict()
+        self.db.commit()
+        self.dirty = False
+        self.last_commit = time.time()
+
+    def _evict(self):
+        # Down to 90% of max_bytes, so not every commit has to evict.
+        evicted = list()
+        for digest, size in self.db.execute(
+                "SELECT digest, size FROM blobs ORDER BY used"):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            evicted.append(digest)
+            self.size -= size
+        self.db.executemany(
+            "DELETE FROM urls WHERE digest = ?", [(digest,) for digest in evicted])
+        self.db.executemany(
+            "DELETE FROM blobs WHERE digest = ?", [(digest,) for digest in evicted])
+        for digest in evicted:
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+        metrics.incr("response_cache_evictions", len(evicted))
+
+
+def _compress(codec, data):
+    if codec == ZSTD:
+        return ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+    return GZIP + gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data):
+    if data[:1] == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read this response cache")
+        return zstandard.ZstdDecompressor().decompress(data[1:])
+    return gzip.decompress(data[1:])